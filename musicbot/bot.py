@@ -23,7 +23,7 @@ import colorlog
 import motor.motor_asyncio
 
 from io import BytesIO, StringIO
-from functools import wraps
+from functools import wraps, partial
 from textwrap import dedent
 from datetime import timedelta
 from collections import defaultdict
@@ -34,8 +34,14 @@ from discord.enums import ChannelType
 from . import exceptions
 from . import downloader
 
-from .playlist import Playlist
-from .player import MusicPlayer
+from .cache import AudioCacheManager, AnalysisStore, OpusCache
+from .loudness import LoudnessAnalyzer
+from .silence import SilenceAnalyzer
+from .broadcast import BroadcastHub
+from .ffmpeg_pool import FFmpegPool
+from . import dsp
+from .playlist import Playlist, SORT_KEYS
+from .player import MusicPlayer, StderrMonitor
 from .entry import StreamPlaylistEntry
 from .opus_loader import load_opus_lib
 from .config import Config, ConfigDefaults
@@ -106,7 +112,17 @@ class MusicBot(discord.Client):
         self.autoplaylist = load_file(self.config.auto_playlist_file)
 
         self.aiolocks = defaultdict(asyncio.Lock)
-        self.downloader = downloader.Downloader(download_folder='audio_cache')
+        self.downloader = downloader.Downloader(
+            download_folder='audio_cache',
+            info_cache_file=self.config.info_cache_file,
+            info_cache_ttl=self.config.info_cache_ttl,
+            info_cache_size=self.config.info_cache_size,
+            metadata_workers=self.config.metadata_workers,
+            download_workers=self.config.download_workers,
+            postprocess_workers=self.config.postprocess_workers,
+            use_processes=self.config.use_process_pool,
+            prefetch_budget=self.config.prefetch_budget
+        )
 
         log.info('Establishing connection to MongoDB database {}'.format(self.database_name))
 
@@ -136,6 +152,59 @@ class MusicBot(discord.Client):
 
         super().__init__()
         self.aiosession = aiohttp.ClientSession(loop=self.loop)
+        self.stderr_monitor = StderrMonitor(self.loop)
+
+        self.ffmpeg_pool = None
+        if self.config.ffmpeg_pool_size:
+            self.ffmpeg_pool = FFmpegPool(self.config.ffmpeg_pool_size, self.loop)
+            self.ffmpeg_pool.start()
+
+        self.broadcasts = None
+        if self.config.broadcast_streams:
+            self.broadcasts = BroadcastHub(self.stderr_monitor, self.loop)
+
+        self.analysis = AnalysisStore(self.config.analysis_file)
+        self.analysis.load()
+        self.analysis.attach(self.downloader.cache_index)
+
+        self.loudness = None
+        if self.config.use_experimental_equalization:
+            self.loudness = LoudnessAnalyzer(
+                self.analysis,
+                runner=partial(self.downloader.postprocess, self.loop),
+                mode=self.config.equalization_mode,
+                loop=self.loop
+            )
+
+        self.silence = None
+        if self.config.trim_silence:
+            self.silence = SilenceAnalyzer(
+                self.analysis,
+                runner=partial(self.downloader.postprocess, self.loop),
+                loop=self.loop
+            )
+
+        self.opus_cache = None
+        if self.config.opus_cache:
+            self.opus_cache = OpusCache(
+                os.path.join(AUDIO_CACHE_PATH, 'opus'),
+                self.config.default_volume,
+                runner=partial(self.downloader.postprocess, self.loop),
+                retain=lambda: self.config.save_videos or self.audio_cache.budgeted,
+                loop=self.loop
+            )
+            self.opus_cache.build()
+
+        self.audio_cache = AudioCacheManager(
+            self.downloader.cache_index,
+            max_bytes=self.config.audio_cache_max_size * 1000000,
+            max_files=self.config.audio_cache_max_files,
+            policy=self.config.audio_cache_policy,
+            pinned=self._pinned_audio_files,
+            retain=lambda: self.config.save_videos,
+            companions=self.opus_cache.forget if self.opus_cache else None,
+            loop=self.loop
+        )
         self.http.user_agent += ' MusicBot/%s' % BOTVERSION
 
         self.spotify = None
@@ -196,6 +265,15 @@ class MusicBot(discord.Client):
                 server.members if server else self.get_all_members()
             )
 
+    def _pinned_audio_files(self):
+        """
+            Yields the filenames of everything playing or queued in any guild, which must stay on disk.
+        """
+        for player in self.players.values():
+            for entry in (player.current_entry, player.playlist.pending_entry, *player.playlist.entries):
+                if entry and entry.filename and not isinstance(entry, StreamPlaylistEntry):
+                    yield entry.filename
+
     def _delete_old_audiocache(self, path=AUDIO_CACHE_PATH):
         try:
             shutil.rmtree(path)
@@ -442,6 +520,8 @@ class MusicBot(discord.Client):
             return
 
         if guild.id in self.players:
+            # Save how far into the song we are first, so a restart can pick it back up
+            await self.serialize_queue(guild)
             self.players.pop(guild.id).kill()
 
         await vc.disconnect()
@@ -498,6 +578,7 @@ class MusicBot(discord.Client):
                        .on('stop', self.on_player_stop) \
                        .on('finished-playing', self.on_player_finished_playing) \
                        .on('entry-added', self.on_player_entry_added) \
+                       .on('entries-changed', self.on_player_entries_changed) \
                        .on('error', self.on_player_error)
 
         player.skip_state = SkipState()
@@ -683,6 +764,12 @@ class MusicBot(discord.Client):
         if entry.meta.get('author') and entry.meta.get('channel'):
             await self.serialize_queue(player.voice_client.channel.guild)
 
+    async def on_player_entries_changed(self, player, playlist, added, removed, **_):
+        log.debug('Running on_player_entries_changed')
+        # Same as for single entries, songs the auto playlist adds on its own aren't worth saving for
+        if removed or not added or any(e.meta.get('author') and e.meta.get('channel') for e in added):
+            await self.serialize_queue(player.voice_client.channel.guild)
+
     async def on_player_error(self, player, entry, ex, **_):
         if 'channel' in entry.meta:
             await self.safe_send_message(
@@ -836,12 +923,19 @@ class MusicBot(discord.Client):
             for guild in sorted(self.guilds, key=lambda s:int(s.id)):
                 f.write('{:<22} {}\n'.format(guild.id, guild.name))
 
-        if not self.config.save_videos and os.path.isdir(AUDIO_CACHE_PATH):
+        if not self.config.save_videos and not self.audio_cache.budgeted and os.path.isdir(AUDIO_CACHE_PATH):
             if self._delete_old_audiocache():
                 log.debug("Deleted old audio cache")
             else:
                 log.debug("Could not delete old audio cache, moving on.")
 
+            self.downloader.cache_index.build()
+            self.analysis.attach(self.downloader.cache_index)
+            if self.opus_cache:
+                self.opus_cache.build()
+
+        self.audio_cache.request_eviction()
+
 
     async def _scheck_server_permissions(self):
         log.debug("Checking server permissions")
@@ -966,6 +1060,18 @@ class MusicBot(discord.Client):
             self.loop.run_until_complete(self.aiosession.close())
         except: pass
 
+        try:
+            self.downloader.shutdown()
+        except: pass
+
+        if self.ffmpeg_pool:
+            self.ffmpeg_pool.close()
+
+        try:
+            self.analysis.save()
+        except Exception:
+            log.warning("Could not save the analysis store", exc_info=True)
+
         pending = asyncio.Task.all_tasks()
         gathered = asyncio.gather(*pending)
 
@@ -1165,6 +1271,20 @@ class MusicBot(discord.Client):
                 log.info("    Delete Invoking: " + ['Disabled', 'Enabled'][self.config.delete_invoking])
             log.info("  Debug Mode: " + ['Disabled', 'Enabled'][self.config.debug_mode])
             log.info("  Downloaded songs will be " + ['deleted', 'saved'][self.config.save_videos])
+            if self.audio_cache.budgeted:
+                log.info("  Audio cache budget: " + str(self.audio_cache))
+            log.info("  Prefetch: {} deep, {} downloads at once".format(self.config.prefetch_depth, self.config.prefetch_budget or 'unlimited'))
+            log.info("  Equalization: " + (self.config.equalization_mode if self.config.use_experimental_equalization else 'Disabled'))
+            log.info("  Audio processing: " + dsp.backend)
+            log.info("  FFmpeg pool: " + ('{} processes'.format(self.config.ffmpeg_pool_size) if self.ffmpeg_pool else 'Disabled'))
+            log.info("  Fair queue: " + ['Disabled', 'Enabled'][self.config.fair_queue])
+            log.info("  Gapless playback: " + (['Disabled', 'Enabled'][self.config.gapless_playback] + (', {}s crossfade'.format(self.config.crossfade) if self.config.crossfade else '')))
+            log.info("  Trim silence: " + ['Disabled', 'Enabled'][self.config.trim_silence])
+            log.info("  Opus cache: " + ['Disabled', 'Enabled'][self.config.opus_cache])
+            log.info("  Shared stream broadcasts: " + ['Disabled', 'Enabled'][self.config.broadcast_streams])
+            log.info("  Lazy playlist entries: " + ['Disabled', 'Enabled'][self.config.lazy_playlist_entries])
+            log.info("  Progressive playback: " + ['Disabled', 'Enabled'][self.config.progressive_playback])
+            log.info("  Metadata cache: " + ('{}s TTL, {} entries'.format(self.config.info_cache_ttl, self.config.info_cache_size) if self.config.info_cache_ttl > 0 else 'Disabled'))
             if self.config.status_message:
                 log.info("  Status message: " + self.config.status_message)
             log.info("  Write current songs to file: " + ['Disabled', 'Enabled'][self.config.write_current_song])
@@ -1174,6 +1294,11 @@ class MusicBot(discord.Client):
             log.info("  Legacy skip: " + ['Disabled', 'Enabled'][self.config.legacy_skip])
             log.info("  Leave non owners: " + ['Disabled', 'Enabled'][self.config.leavenonowners])
 
+        if dsp.backend == 'audioop':
+            log.warning("numpy is not installed, audio processing falls back to audioop. "
+                        "Volume changes will step once per frame and loud songs will clip hard. "
+                        "Install the requirements again to get numpy.")
+
         print(flush=True)
 
         await self.update_now_playing_status()
@@ -1723,12 +1848,35 @@ class MusicBot(discord.Client):
         content.add_field(name="Author", value="Neon#4792")
         content.add_field(name="BotID", value=self.user.id)
         content.add_field(name="Songs Played", value=player.songs_played)
+        content.add_field(name="Download Waits", value=player.wait_stats)
+        content.add_field(name="Track Gaps", value=player.gap_stats)
+        playback = player.get_playback_stats()
+        content.add_field(name="Playback", value="%.2fms p99 read\n%d late, %d slow reads, %d underruns" % (
+            playback['read_latency']['p99'], playback['late_frames'], playback['slow_reads'], playback['underruns']))
+        content.add_field(name="FFmpeg", value="%d warnings\n%d errors\n%d watched now" % (
+            player.ffmpeg_counts['warnings'], player.ffmpeg_counts['errors'], self.stderr_monitor.watching))
+        content.add_field(name="Prefetch", value="%d deep, %d running\n%d throttled" % (
+            player.playlist.prefetch_depth, self.downloader.prefetching, self.downloader.prefetches_throttled))
         content.add_field(name="Messages", value=str(self.message_count) + ' (' + '%.2f'%(self.message_count / (time.time()-self.uptime)) +'/sec)')
         process = psutil.Process(os.getpid())
         mem = process.memory_full_info()
         mem = mem.uss / 1000000
         content.add_field(name="Memory Usage", value='%.2f'%(mem) + "MB")
         content.add_field(name="Servers", value="I am running on " + str(len(self.guilds)) + " servers")
+        if self.downloader.info_cache:
+            content.add_field(name="Metadata Cache", value="%d hits\n%d misses" % (self.downloader.info_cache.hits, self.downloader.info_cache.misses))
+        content.add_field(name="Audio Cache", value=str(self.audio_cache))
+        if self.opus_cache:
+            content.add_field(name="Opus Cache", value=str(self.opus_cache))
+        if self.ffmpeg_pool:
+            content.add_field(name="FFmpeg Pool", value=str(self.ffmpeg_pool))
+        if self.broadcasts:
+            content.add_field(name="Broadcasts", value=str(self.broadcasts))
+        if self.loudness:
+            content.add_field(name="Equalization", value=str(self.loudness))
+        if self.silence:
+            content.add_field(name="Silence Trimming", value=str(self.silence))
+        content.add_field(name="Worker Pools", value='\n'.join(str(pool) for pool in self.downloader.pools), inline=False)
         ctime = float(time.time()-self.uptime)
         day = ctime // (24 * 3600)
         ctime = ctime % (24 * 3600)
@@ -2621,12 +2769,8 @@ class MusicBot(discord.Client):
 
                 t0 = time.time()
 
-                # My test was 1.2 seconds per song, but we maybe should fudge it a bit, unless we can
-                # monitor it and edit the message with the estimated time, but that's some ADVANCED SHIT
-                # I don't think we can hook into it anyways, so this will have to do.
-                # It would probably be a thread to check a few playlists and get the speed from that
-                # Different playlists might download at different speeds though
-                wait_per_song = 1.2
+                # ytdl works through the whole list in one call here, one song after another
+                wait_per_song = self.downloader.average_extract_time
 
                 procmesg = await self.safe_send_message(
                     channel,
@@ -2650,13 +2794,12 @@ class MusicBot(discord.Client):
                 drop_count = 0
 
                 if permissions.max_song_length:
-                    for e in entry_list.copy():
-                        if e.duration > permissions.max_song_length:
-                            player.playlist.entries.remove(e)
-                            entry_list.remove(e)
-                            drop_count += 1
-                            # Im pretty sure there's no situation where this would ever break
-                            # Unless the first entry starts being played, which would make this a race condition
+                    too_long = {e for e in entry_list if e.duration > permissions.max_song_length}
+                    player.playlist.remove_if(lambda e: e in too_long)
+                    entry_list = [e for e in entry_list if e not in too_long]
+                    drop_count = len(too_long)
+                    # Im pretty sure there's no situation where this would ever break
+                    # Unless the first entry starts being played, which would make this a race condition
                     if drop_count:
                         print("Dropped %s songs" % drop_count)
 
@@ -2726,18 +2869,28 @@ class MusicBot(discord.Client):
         if not info:
             raise exceptions.CommandError(self.str.get('cmd-play-playlist-invalid', "That playlist cannot be played."))
 
-        num_songs = sum(1 for _ in info['entries'])
+        entries = list(info['entries'])
+        num_songs = len(entries)
         t0 = time.time()
 
+        # Songs are resolved a few at a time, apart from lazy ones, see Playlist._add_items_in_order
+        to_resolve = num_songs
+        if self.config.lazy_playlist_entries:
+            to_resolve = sum(1 for e in entries if e and not e.get('title'))
+
+        expected_time = self.downloader.estimate_extract_time(to_resolve, parallel=True)
+        wait_per_song = expected_time / num_songs if num_songs else 0
+
         busymsg = await self.safe_send_message(
-            channel, self.str.get('cmd-play-playlist-process', "Processing {0} songs...").format(num_songs))  # TODO: From playlist_title
+            channel, self.str.get('cmd-play-playlist-process', "Processing {0} songs...").format(num_songs) +
+            (self.str.get('cmd-play-playlist-gathering-2', ', ETA: {0} seconds').format(fixg(expected_time)) if num_songs >= 10 else ''))  # TODO: From playlist_title
         await self.send_typing(channel)
 
         entries_added = 0
         if extractor_type == 'youtube:playlist':
             try:
                 entries_added = await player.playlist.async_process_youtube_playlist(
-                    playlist_url, channel=channel, author=author)
+                    playlist_url, max_duration=permissions.max_song_length, channel=channel, author=author)
                 # TODO: Add hook to be called after each song
                 # TODO: Add permissions
 
@@ -2748,7 +2901,7 @@ class MusicBot(discord.Client):
         elif extractor_type.lower() in ['soundcloud:set', 'bandcamp:album']:
             try:
                 entries_added = await player.playlist.async_process_sc_bc_playlist(
-                    playlist_url, channel=channel, author=author)
+                    playlist_url, max_duration=permissions.max_song_length, channel=channel, author=author)
                 # TODO: Add hook to be called after each song
                 # TODO: Add permissions
 
@@ -2762,14 +2915,10 @@ class MusicBot(discord.Client):
         skipped = False
 
         if permissions.max_song_length:
-            for e in entries_added.copy():
-                if e.duration > permissions.max_song_length:
-                    try:
-                        player.playlist.entries.remove(e)
-                        entries_added.remove(e)
-                        drop_count += 1
-                    except:
-                        pass
+            added = set(entries_added)
+            dropped = set(player.playlist.remove_if(lambda e: e in added and e.duration > permissions.max_song_length))
+            entries_added = [e for e in entries_added if e not in dropped]
+            drop_count = len(dropped)
 
             if drop_count:
                 log.debug("Dropped %s songs" % drop_count)
@@ -2786,8 +2935,6 @@ class MusicBot(discord.Client):
         songs_added = len(entries_added)
         tnow = time.time()
         ttime = tnow - t0
-        wait_per_song = 1.2
-        # TODO: actually calculate wait per song in the process function and return that too
 
         # This is technically inaccurate since bad songs are ignored but still take up time
         log.info("Processed {}/{} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
@@ -2975,8 +3122,10 @@ class MusicBot(discord.Client):
                 await self.safe_delete_message(self.server_specific_data[guild]['last_np_msg'])
                 self.server_specific_data[guild]['last_np_msg'] = None
 
+            playback = player.get_playback_stats()
+
             # TODO: Fix timedelta garbage with util function
-            song_progress = ftimedelta(timedelta(seconds=player.progress))
+            song_progress = ftimedelta(timedelta(seconds=playback['progress']))
             song_total = ftimedelta(timedelta(seconds=player.current_entry.duration))
 
             streaming = isinstance(player.current_entry, StreamPlaylistEntry)
@@ -2988,7 +3137,7 @@ class MusicBot(discord.Client):
             # percentage shows how much of the current song has already been played
             percentage = 0.0
             if player.current_entry.duration > 0:
-                percentage = player.progress / player.current_entry.duration
+                percentage = playback['progress'] / player.current_entry.duration
 
             # create the actual bar
             progress_bar_length = 30
@@ -3021,6 +3170,9 @@ class MusicBot(discord.Client):
                     url=player.current_entry.url
                 )
 
+            if playback['late_ratio'] > 0.02:
+                np_text += self.str.get('cmd-np-stutter', "\n\N{WARNING SIGN} Playback is stuttering, {0:.0%} of the last minute's audio was late").format(playback['late_ratio'])
+
             if thumbnail:
                 self.server_specific_data[guild]['last_np_msg'] = await self.safe_send_file(channel, np_text, thumbnail)
             else:
@@ -3106,6 +3258,44 @@ class MusicBot(discord.Client):
         else:
             raise exceptions.CommandError(self.str.get('cmd-resume-none', 'Player is not paused.'), expire_in=30)
 
+    async def cmd_seek(self, player, position=None):
+        """
+        Usage:
+            {command_prefix}seek [[hh:]mm:]ss
+            {command_prefix}seek (+/-)seconds
+
+        Jumps to a point in the current song.
+        Putting + or - before the time will move relative to where the song is now.
+        """
+
+        if not player.current_entry:
+            raise exceptions.CommandError(self.str.get('cmd-seek-none', 'Nothing is playing.'), expire_in=20)
+
+        if not position:
+            return Response(self.str.get('cmd-seek-current', 'Currently at `{0}`').format(
+                ftimedelta(timedelta(seconds=player.progress))), delete_after=20)
+
+        relative = position[0] in '+-'
+
+        try:
+            seconds = 0
+            for part in position.lstrip('+-').split(':'):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            raise exceptions.CommandError(self.str.get('cmd-seek-invalid', '`{0}` is not a valid time').format(position), expire_in=20)
+
+        if relative:
+            seconds = player.progress + (seconds if position[0] == '+' else -seconds)
+
+        try:
+            await player.seek(seconds)
+        except ValueError:
+            raise exceptions.CommandError(self.str.get('cmd-seek-unseekable', "Can't seek to `{0}` in this song.").format(
+                ftimedelta(timedelta(seconds=max(0, seconds)))), expire_in=20)
+
+        return Response(self.str.get('cmd-seek-reply', 'Seeked **{0}** to `{1}`').format(
+            player.current_entry.title, ftimedelta(timedelta(seconds=max(0, seconds)))), delete_after=20)
+
     async def cmd_shuffle(self, channel, player):
         """
         Usage:
@@ -3130,6 +3320,45 @@ class MusicBot(discord.Client):
         await self.safe_delete_message(hand, quiet=True)
         return Response(self.str.get('cmd-shuffle-reply', "Shuffled `{0}`'s queue.").format(player.voice_client.channel.guild), delete_after=15)
 
+    async def cmd_sort(self, player, key, order=None):
+        """
+        Usage:
+            {command_prefix}sort duration|author|title [desc]
+
+        Sorts the server's queue by song length, by who queued each song or by title.
+        """
+
+        key = key.lower()
+        if key not in SORT_KEYS:
+            raise exceptions.CommandError(self.str.get('cmd-sort-invalid', "Can't sort by `{0}`, try one of: {1}").format(
+                key, ', '.join(SORT_KEYS)), expire_in=20)
+
+        player.playlist.sort(key, reverse=bool(order and order.lower() == 'desc'))
+        return Response(self.str.get('cmd-sort-reply', "Sorted `{0}`'s queue by {1}.").format(player.voice_client.channel.guild, key), delete_after=15)
+
+    async def cmd_reverse(self, player):
+        """
+        Usage:
+            {command_prefix}reverse
+
+        Reverses the order of the server's queue.
+        """
+
+        player.playlist.reverse()
+        return Response(self.str.get('cmd-reverse-reply', "Reversed `{0}`'s queue.").format(player.voice_client.channel.guild), delete_after=15)
+
+    async def cmd_dedupe(self, player):
+        """
+        Usage:
+            {command_prefix}dedupe
+
+        Removes songs that are already queued further up.
+        """
+
+        removed = player.playlist.dedupe()
+        return Response(self.str.get('cmd-dedupe-reply', "Removed {0} duplicate songs from `{1}`'s queue.").format(
+            len(removed), player.voice_client.channel.guild), delete_after=15)
+
     async def cmd_clear(self, player, author):
         """
         Usage:
@@ -3156,9 +3385,7 @@ class MusicBot(discord.Client):
             for user in user_mentions:
                 if permissions.remove or author == user:
                     try:
-                        entry_indexes = [e for e in player.playlist.entries if e.meta.get('author', None) == user]
-                        for entry in entry_indexes:
-                            player.playlist.entries.remove(entry)
+                        entry_indexes = player.playlist.remove_if(lambda e: e.meta.get('author', None) == user)
                         entry_text = '%s ' % len(entry_indexes) + 'item'
                         if len(entry_indexes) > 1:
                             entry_text += 's'
@@ -3312,6 +3539,37 @@ class MusicBot(discord.Client):
                 raise exceptions.CommandError(
                     self.str.get('cmd-volume-unreasonable-absolute', 'Unreasonable volume provided: {}%. Provide a value between 1 and 100.').format(new_volume), expire_in=20)
 
+    async def cmd_prefetch(self, player, permissions, depth=None):
+        """
+        Usage:
+            {command_prefix}prefetch [depth]
+
+        Shows or sets how many of the upcoming songs in this server are downloaded ahead of time.
+        Downloads beyond the next song are skipped while the bot is busy or low on disk space.
+        """
+
+        if depth is None:
+            return Response(self.str.get('cmd-prefetch-current', 'Prefetching the next **%d** song(s).') % player.playlist.prefetch_depth, reply=True, delete_after=20)
+
+        if not permissions.prefetch:
+            raise exceptions.PermissionsError(
+                self.str.get('cmd-prefetch-noperms', "You are not allowed to change how many songs are prefetched"), expire_in=20)
+
+        try:
+            depth = int(depth)
+        except ValueError:
+            raise exceptions.CommandError(self.str.get('cmd-prefetch-invalid', '`{0}` is not a valid number').format(depth), expire_in=20)
+
+        max_depth = self.config.prefetch_budget or 25
+        if not 1 <= depth <= max_depth:
+            raise exceptions.CommandError(self.str.get('cmd-prefetch-unreasonable', 'Provide a prefetch depth between 1 and {}.').format(max_depth), expire_in=20)
+
+        player.playlist.prefetch_depth = depth
+        player.playlist.prefetch()
+        self.downloader.reprioritize(self.loop)
+
+        return Response(self.str.get('cmd-prefetch-reply', 'Now prefetching the next **%d** song(s).') % depth, reply=True, delete_after=20)
+
     @owner_only
     async def cmd_option(self, player, option, value):
         """
@@ -3391,13 +3649,19 @@ class MusicBot(discord.Client):
                 lines.append(self.str.get('cmd-queue-playing-noauthor', "Currently playing: `{0}` {1}\n").format(player.current_entry.title, prog_str))
 
 
-        for i, item in enumerate(player.playlist, 1):
+        currentlinesum = sum(len(x) + 1 for x in lines)  # +1 is for newline char
+
+        # There's no telling when a stream ends, so no start times while one is playing
+        show_eta = not (player.current_entry and not player.current_entry.duration)
+
+        for i, (item, time_until) in enumerate(player.playlist.estimate_times(player), 1):
             if item.meta.get('channel', False) and item.meta.get('author', False):
                 nextline = self.str.get('cmd-queue-entry-author', '{0} -- `{1}` by `{2}`').format(i, item.title, item.meta['author'].name).strip()
             else:
                 nextline = self.str.get('cmd-queue-entry-noauthor', '{0} -- `{1}`').format(i, item.title).strip()
 
-            currentlinesum = sum(len(x) + 1 for x in lines)  # +1 is for newline char
+            if show_eta:
+                nextline += self.str.get('cmd-queue-entry-eta', ' - in {0}').format(ftimedelta(time_until))
 
             if (currentlinesum + len(nextline) + len(andmoretext) > DISCORD_MSG_CHAR_LIMIT) or (i > self.config.queue_length):
                 if currentlinesum + len(andmoretext):
@@ -3405,6 +3669,7 @@ class MusicBot(discord.Client):
                     continue
 
             lines.append(nextline)
+            currentlinesum += len(nextline) + 1
 
         if unlisted:
             lines.append(self.str.get('cmd-queue-more', '\n... and %s more') % unlisted)
@@ -0,0 +1,207 @@
+import time
+import logging
+import threading
+
+from discord import AudioSource
+from discord.opus import Encoder
+from collections import deque, Counter
+
+log = logging.getLogger(__name__)
+
+SILENCE = b'\0' * Encoder.FRAME_SIZE
+
+
+class Broadcast:
+    """
+        One ffmpeg process decoding a stream, with every frame it decodes copied out to each subscriber.
+    """
+
+    buffer_frames = 250  # how far (5s) a subscriber can fall behind before it starts losing frames
+    lead_frames = 100  # how far (2s) the reader can get ahead of real time, to soak up bursty streams
+
+    def __init__(self, hub, key, source):
+        self.hub = hub
+        self.key = key
+        self.source = source
+        self.subscribers = []
+
+        self.stderr_future = hub.loop.create_future()
+        self.counts = Counter()
+
+        self.frames = 0
+        self.dropped = 0
+        self.ended = False
+
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="broadcast reader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+
+        try:
+            while not self.ended:
+                frame = self.source.read()
+                if not frame:
+                    break
+
+                with self._cond:
+                    for subscriber in self.subscribers:
+                        if len(subscriber.frames) == subscriber.frames.maxlen:
+                            self.dropped += 1
+                        subscriber.frames.append(frame)
+
+                    self._cond.notify_all()
+
+                self.frames += 1
+
+                # ffmpeg decodes files as fast as it can, so keep it to real time
+                delay = start + (self.frames - self.lead_frames) * 0.02 - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        except Exception:
+            log.exception("Broadcast of {} failed".format(self.key))
+
+        finally:
+            with self._cond:
+                self.ended = True
+                self._cond.notify_all()
+
+            self.hub._ended(self)
+
+    def add(self, subscriber):
+        with self._cond:
+            self.subscribers.append(subscriber)
+
+    def remove(self, subscriber):
+        with self._cond:
+            self.subscribers.remove(subscriber)
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self.ended = True
+        self.source.cleanup()
+
+    def __str__(self):
+        return '{} ({} listening)'.format(self.key, len(self.subscribers))
+
+
+class BroadcastSubscriber(AudioSource):
+    """
+        One guild's view of a `Broadcast`.  Reads hand out the frames decoded since the last read, or silence while
+        the stream catches up, so a subscriber that joins mid-stream picks up from the live position.
+    """
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.frames = deque(maxlen=Broadcast.buffer_frames)
+        self.underruns = 0
+        self._closed = False
+
+    def read(self):
+        broadcast = self.broadcast
+
+        with broadcast._cond:
+            if not self.frames and not broadcast.ended:
+                broadcast._cond.wait(0.02)
+
+            if self.frames:
+                return self.frames.popleft()
+
+            if broadcast.ended:
+                return b''
+
+        # An empty read would end playback, so keep the connection going while the stream catches up
+        self.underruns += 1
+        return SILENCE
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            self.broadcast.hub.unsubscribe(self)
+
+
+class BroadcastHub:
+    """
+        Shares one decoding ffmpeg process between every player on the same stream.  The first subscriber to a
+        stream starts its broadcast, and the broadcast shuts down when the last one leaves.
+    """
+
+    def __init__(self, stderr_monitor, loop):
+        self.stderr_monitor = stderr_monitor
+        self.loop = loop
+
+        self._broadcasts = {}
+        self._lock = threading.Lock()  # unsubscribes come from the voice threads
+
+        self.started = 0
+        self.subscriptions = 0
+
+    def subscribe(self, key, factory):
+        """
+            Returns a new subscriber to the broadcast for `key`, starting one from the source `factory` returns if
+            there isn't one running.
+        """
+        started = False
+
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+
+            if broadcast is None or broadcast.ended:
+                broadcast = Broadcast(self, key, factory())
+                self._broadcasts[key] = broadcast
+                self.started += 1
+                started = True
+
+            subscriber = BroadcastSubscriber(broadcast)
+            broadcast.add(subscriber)
+            self.subscriptions += 1
+
+        if started:
+            log.debug("Starting broadcast of {}".format(key))
+            self.stderr_monitor.watch(broadcast.source._process, broadcast.stderr_future, broadcast.counts)
+            broadcast.start()
+        else:
+            log.debug("Joining broadcast of {}".format(broadcast))
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        broadcast = subscriber.broadcast
+
+        with self._lock:
+            broadcast.remove(subscriber)
+            if broadcast.subscribers:
+                return
+
+            if self._broadcasts.get(broadcast.key) is broadcast:
+                del self._broadcasts[broadcast.key]
+
+        log.debug("Last listener left, stopping broadcast of {}".format(broadcast.key))
+        broadcast.close()
+
+    def _ended(self, broadcast):
+        with self._lock:
+            if self._broadcasts.get(broadcast.key) is broadcast:
+                del self._broadcasts[broadcast.key]
+
+    @property
+    def listeners(self):
+        return sum(len(b.subscribers) for b in list(self._broadcasts.values()))
+
+    def __len__(self):
+        return len(self._broadcasts)
+
+    def __str__(self):
+        return '{} streams, {} listening\n{} ffmpeg processes saved'.format(
+            len(self), self.listeners, self.subscriptions - self.started)
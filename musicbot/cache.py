@@ -0,0 +1,679 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import subprocess
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+log = logging.getLogger(__name__)
+
+
+class InfoCache:
+    """
+        An on-disk cache for youtube_dl extraction results, keyed by extractor and video id where known
+        and by normalized url otherwise.  Entries expire after `ttl` seconds and the least recently used
+        ones are evicted once there are more than `max_entries` of them.
+    """
+
+    _tracking_params = ('feature', 'si', 'app', 'ab_channel')
+
+    def __init__(self, path, *, ttl=3600, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS info ('
+            'key TEXT NOT NULL, process INTEGER NOT NULL, data TEXT NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (key, process))'
+        )
+        self._db.execute('CREATE TABLE IF NOT EXISTS alias (alias TEXT PRIMARY KEY, key TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS info_accessed ON info (accessed)')
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    @classmethod
+    def normalize_url(cls, url):
+        """
+            Returns a normalized form of `url` so trivially different links to the same thing share a key.
+            Anything that isn't an http(s) url (search strings, extractor prefixed ids) is only stripped.
+        """
+        url = url.strip().strip('<>')
+
+        parts = urlsplit(url)
+        if parts.scheme.lower() not in ('http', 'https') or not parts.netloc:
+            return url
+
+        netloc = parts.netloc.lower()
+        for prefix in ('www.', 'm.', 'music.'):
+            if netloc.startswith(prefix):
+                netloc = netloc[len(prefix):]
+                break
+
+        path = parts.path
+        query = [(k, v) for k, v in parse_qsl(parts.query) if not k.startswith('utm_') and k not in cls._tracking_params]
+
+        if netloc == 'youtu.be' and path.strip('/'):
+            query.append(('v', path.strip('/')))
+            netloc, path = 'youtube.com', '/watch'
+
+        return urlunsplit(('https', netloc, path.rstrip('/') or '/', urlencode(sorted(query)), ''))
+
+    @staticmethod
+    def _cacheable(info):
+        if not isinstance(info, dict) or info.get('is_live'):
+            return False
+
+        if 'entries' in info:
+            # Flat playlist results hold a lazy generator that must not be consumed here
+            return isinstance(info['entries'], list) and all(info['entries'])
+
+        return True
+
+    def _resolve(self, url):
+        norm = self.normalize_url(url)
+        row = self._db.execute('SELECT key FROM alias WHERE alias = ?', (norm,)).fetchone()
+        return row[0] if row else norm
+
+    def get(self, url, process=True):
+        if not self.enabled:
+            return None
+
+        key = self._resolve(url)
+        row = self._db.execute(
+            'SELECT data, created FROM info WHERE key = ? AND process = ?', (key, int(process))).fetchone()
+
+        now = time.time()
+        if row and now - row[1] < self.ttl:
+            self._db.execute('UPDATE info SET accessed = ? WHERE key = ? AND process = ?', (now, key, int(process)))
+            self.hits += 1
+            log.debug("Info cache hit for {}".format(url))
+            return json.loads(row[0])
+
+        if row:
+            self._db.execute('DELETE FROM info WHERE key = ? AND process = ?', (key, int(process)))
+
+        self.misses += 1
+        return None
+
+    def put(self, url, info, process=True):
+        if not self.enabled or not self._cacheable(info):
+            return
+
+        try:
+            data = json.dumps(info)
+        except (TypeError, ValueError):
+            log.debug("Could not cache info for {}, not serializable".format(url))
+            return
+
+        if info.get('extractor_key') and info.get('id'):
+            key = '{}:{}'.format(info['extractor_key'], info['id'])
+        else:
+            key = self.normalize_url(url)
+
+        now = time.time()
+        self._db.execute('INSERT OR REPLACE INTO info VALUES (?, ?, ?, ?, ?)', (key, int(process), data, now, now))
+
+        aliases = {self.normalize_url(url)}
+        if info.get('webpage_url'):
+            aliases.add(self.normalize_url(info['webpage_url']))
+        self._db.executemany('INSERT OR REPLACE INTO alias VALUES (?, ?)', [(a, key) for a in aliases if a != key])
+
+        self._puts += 1
+        if self._puts % 64 == 1:
+            self.evict()
+
+    def evict(self):
+        """
+            Removes expired entries and trims the cache down to `max_entries`, least recently used first.
+        """
+        self._db.execute('DELETE FROM info WHERE created < ?', (time.time() - self.ttl,))
+
+        count = self._db.execute('SELECT COUNT(*) FROM info').fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                'DELETE FROM info WHERE rowid IN (SELECT rowid FROM info ORDER BY accessed LIMIT ?)',
+                (count - self.max_entries,))
+
+        self._db.execute('DELETE FROM alias WHERE key NOT IN (SELECT key FROM info)')
+
+    def clear(self):
+        self._db.execute('DELETE FROM info')
+        self._db.execute('DELETE FROM alias')
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM info').fetchone()[0]
+
+
+class CachedFile:
+    __slots__ = ['path', 'size', 'mtime', 'hash', 'thumbnail', 'last_used', 'uses']
+
+    def __init__(self, path, size, mtime, thumbnail=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.hash = None
+        self.thumbnail = thumbnail
+        self.last_used = mtime
+        self.uses = 0
+
+    @property
+    def stem(self):
+        return os.path.basename(self.path).rsplit('.', 1)[0]
+
+    def __repr__(self):
+        return '<CachedFile {0.path} ({0.size} bytes)>'.format(self)
+
+
+class AudioCacheIndex:
+    """
+        An in-memory view of the audio cache folder, so finding a cached download never has to list the folder.
+        Files are keyed by their name without extension, which for ytdl downloads is "extractor-id-title".
+        The folder is scanned once in `build`, after that the index is kept up to date through `add` and `remove`.
+    """
+
+    image_exts = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._files = {}       # stem -> CachedFile
+        self._generic = {}     # stem without the hash suffix generic downloads get -> CachedFile
+        self._thumbnails = {}  # stem -> thumbnail path
+        self.on_remove = None  # called with each CachedFile taken out through `remove`
+
+    def build(self):
+        self._files.clear()
+        self._generic.clear()
+        self._thumbnails.clear()
+
+        if not self.folder or not os.path.isdir(self.folder):
+            return
+
+        thumbnails = []
+        for dentry in os.scandir(self.folder):
+            if not dentry.is_file():
+                continue
+
+            if dentry.name.lower().endswith(self.image_exts):
+                thumbnails.append(dentry.path)
+            else:
+                stat = dentry.stat()
+                self._add(CachedFile(dentry.path, stat.st_size, stat.st_mtime))
+
+        for path in thumbnails:
+            self._add_thumbnail(path)
+
+        log.debug("Indexed {} files in {}".format(len(self._files), self.folder))
+
+    def _add(self, cached):
+        self._files[cached.stem] = cached
+        self._generic[os.path.basename(cached.path).rsplit('-', 1)[0]] = cached
+        cached.thumbnail = self._thumbnails.get(cached.stem)
+
+    def _add_thumbnail(self, path):
+        stem = os.path.basename(path).rsplit('.', 1)[0]
+        self._thumbnails[stem] = path
+
+        if stem in self._files:
+            self._files[stem].thumbnail = path
+
+    def add(self, path):
+        """
+            Registers a freshly downloaded file, along with any thumbnail ytdl wrote next to it.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            log.debug("Not indexing missing file {}".format(path))
+            return None
+
+        cached = CachedFile(path, stat.st_size, stat.st_mtime)
+        self._add(cached)
+
+        if cached.thumbnail is None:
+            cached.thumbnail = self.find_thumbnail(path)
+
+        return cached
+
+    def find_thumbnail(self, path):
+        """
+            Returns the thumbnail saved alongside `path`, checking the handful of names it could have on disk
+            if it hasn't been indexed yet.
+        """
+        thumbnail = self.thumbnail_for(path)
+        if thumbnail:
+            return thumbnail
+
+        base = path.rsplit('.', 1)[0]
+        for ext in self.image_exts:
+            if os.path.isfile(base + ext):
+                self._add_thumbnail(base + ext)
+                return base + ext
+
+    def remove(self, path):
+        stem = os.path.basename(path).rsplit('.', 1)[0]
+        cached = self._files.get(stem)
+
+        if cached and cached.path == path:
+            del self._files[stem]
+            generic_key = os.path.basename(path).rsplit('-', 1)[0]
+            if self._generic.get(generic_key) is cached:
+                del self._generic[generic_key]
+
+            if cached.thumbnail:
+                self._thumbnails.pop(os.path.basename(cached.thumbnail).rsplit('.', 1)[0], None)
+
+            if self.on_remove:
+                self.on_remove(cached)
+
+        return cached
+
+    def get(self, path):
+        cached = self._files.get(os.path.basename(path).rsplit('.', 1)[0])
+        if cached and cached.path == path:
+            return cached
+
+    def find(self, expected_filename):
+        """
+            Returns the cached file for `expected_filename`, which may have been saved with a different extension.
+        """
+        return self._files.get(os.path.basename(expected_filename).rsplit('.', 1)[0])
+
+    def find_generic(self, expected_filename):
+        """
+            Returns the cached file for a generic extractor download, whose name has a content hash appended.
+        """
+        return self._generic.get(os.path.basename(expected_filename).rsplit('.', 1)[0])
+
+    def thumbnail_for(self, path):
+        return self._thumbnails.get(os.path.basename(path).rsplit('.', 1)[0])
+
+    def __iter__(self):
+        return iter(list(self._files.values()))
+
+    def __len__(self):
+        return len(self._files)
+
+
+class AnalysisStore:
+    """
+        Results of analysing cached audio files, saved as JSON.  Results are keyed by the md5 of the file's contents,
+        so they outlive renames and re-downloads of the same file.  File names are mapped to their hash too,
+        checked against the file's size and mtime, so a known file doesn't need hashing again.
+    """
+
+    save_delay = 30  # seconds of changes gathered up before they're written out
+
+    def __init__(self, path):
+        self.path = path
+        self._results = {}  # hash -> {kind: result}
+        self._hashes = {}   # file name -> [hash, size, mtime]
+        self._dirty = False
+        self._save_handle = None
+        self._index = None  # the AudioCacheIndex whose files get their hashes from here
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf8') as f:
+                data = json.load(f)
+
+            self._results = data.get('results', {})
+            self._hashes = data.get('hashes', {})
+        except FileNotFoundError:
+            pass
+        except Exception:
+            log.warning("Could not load the analysis store at {}, starting over".format(self.path), exc_info=True)
+
+    def save_soon(self, loop):
+        """
+            Saves in `save_delay` seconds, so a run of analyses rewrites the file once instead of after every one.
+        """
+        if self._dirty and self._save_handle is None:
+            self._save_handle = loop.call_later(self.save_delay, self.save)
+
+    def save(self):
+        if self._save_handle:
+            self._save_handle.cancel()
+            self._save_handle = None
+
+        if not self._dirty:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf8') as f:
+            json.dump({'results': self._results, 'hashes': self._hashes}, f)
+
+        os.replace(temp, self.path)
+        self._dirty = False
+
+    def hash_for(self, filename):
+        """
+            Returns the content hash we have for `filename`, if the file hasn't changed since.
+        """
+        known = self._hashes.get(os.path.basename(filename))
+        if not known:
+            return None
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+
+        fhash, size, mtime = known
+        if stat.st_size == size and stat.st_mtime == mtime:
+            return fhash
+
+    def set_hash(self, filename, fhash):
+        stat = os.stat(filename)
+        self._hashes[os.path.basename(filename)] = [fhash, stat.st_size, stat.st_mtime]
+        self._dirty = True
+
+        cached = self._index and self._index.get(filename)
+        if cached:
+            cached.hash = fhash
+
+    def attach(self, index):
+        """
+            Fills in the hashes of the files in `index` that we know, and keeps them filled in as files are hashed.
+            Hashes of files that are no longer in the index are dropped, now and as files are removed from it.
+        """
+        self._index = index
+        index.on_remove = self.forget
+
+        names = set()
+        for cached in index:
+            name = os.path.basename(cached.path)
+            names.add(name)
+
+            known = self._hashes.get(name)
+            if known and known[1:] == [cached.size, cached.mtime]:
+                cached.hash = known[0]
+
+        for name in [name for name in self._hashes if name not in names]:
+            del self._hashes[name]
+            self._dirty = True
+
+    def forget(self, cached):
+        """
+            Drops the hash of a file that has left the cache.  Results stay, they're keyed by content.
+        """
+        if self._hashes.pop(os.path.basename(cached.path), None):
+            self._dirty = True
+
+    def get(self, filename, kind):
+        fhash = self.hash_for(filename)
+        return self.get_by_hash(fhash, kind) if fhash else None
+
+    def get_by_hash(self, fhash, kind):
+        return self._results.get(fhash, {}).get(kind)
+
+    def put(self, fhash, kind, result):
+        self._results.setdefault(fhash, {})[kind] = result
+        self._dirty = True
+
+
+class OpusCache:
+    """
+        Ogg Opus copies of downloaded files, encoded once at a fixed volume.  Playing one of these at that volume
+        hands its packets straight to discord, with no decoding, volume scaling or encoding on the way.
+        Copies are named "<stem>.<volume>.opus", with the volume in percent, and are indexed in memory.
+    """
+
+    bitrate = '128k'
+
+    def __init__(self, folder, volume, *, runner, retain=None, loop=None):
+        self.folder = folder
+        self.volume = volume
+        self.runner = runner  # coroutine function that runs a blocking call off the event loop
+        self.retain = retain or (lambda: True)
+        self.loop = loop or asyncio.get_event_loop()
+
+        self._files = {}  # stem -> {volume percent: path}
+        self._pending = {}
+
+        self.hits = 0
+        self.encoded = 0
+        self.failed = 0
+
+    def build(self):
+        self._files.clear()
+        os.makedirs(self.folder, exist_ok=True)
+
+        for dentry in os.scandir(self.folder):
+            parts = dentry.name.rsplit('.', 2)
+            if dentry.is_file() and len(parts) == 3 and parts[2] == 'opus' and parts[1].isdigit():
+                self._files.setdefault(parts[0], {})[int(parts[1])] = dentry.path
+
+        log.debug("Indexed {} opus files in {}".format(sum(len(v) for v in self._files.values()), self.folder))
+
+    @staticmethod
+    def _stem(filename):
+        return os.path.basename(filename).rsplit('.', 1)[0]
+
+    @staticmethod
+    def _percent(volume):
+        return int(round(volume * 100))
+
+    def get(self, filename, volume):
+        """
+            Returns the opus copy of `filename` encoded at `volume`, if there is one.
+        """
+        path = self._files.get(self._stem(filename), {}).get(self._percent(volume))
+        if path:
+            self.hits += 1
+        return path
+
+    def request(self, filename):
+        """
+            Schedules an encode of `filename` at our volume, unless there's a copy already or the file won't be kept.
+        """
+        stem = self._stem(filename)
+        percent = self._percent(self.volume)
+
+        if percent in self._files.get(stem, {}) or (stem, percent) in self._pending or not self.retain():
+            return
+
+        path = os.path.join(self.folder, '{}.{}.opus'.format(stem, percent))
+        self._pending[stem, percent] = asyncio.ensure_future(self._encode(filename, path, stem, percent), loop=self.loop)
+
+    async def _encode(self, filename, path, stem, percent):
+        try:
+            await self.runner(self._run_ffmpeg, filename, path, self.volume, self.bitrate)
+        except Exception as e:
+            self.failed += 1
+            log.warning("Failed to encode opus copy of {}: {}".format(filename, e))
+        else:
+            self._files.setdefault(stem, {})[percent] = path
+            self.encoded += 1
+            log.debug("Encoded opus copy of {}".format(filename))
+        finally:
+            self._pending.pop((stem, percent), None)
+
+    @staticmethod
+    def _run_ffmpeg(filename, path, volume, bitrate):
+        temp = path + '.part'
+        cmd = [
+            'ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', filename, '-vn',
+            '-af', 'volume={:.4f}'.format(volume), '-ar', '48000', '-ac', '2',
+            '-c:a', 'libopus', '-b:a', bitrate, '-frame_duration', '20', '-f', 'opus', temp
+        ]
+
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode:
+                raise RuntimeError(result.stderr.decode('utf8', 'replace').strip() or 'ffmpeg exited with {}'.format(result.returncode))
+
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.unlink(temp)
+
+    def forget(self, filename):
+        """
+            Drops every copy of `filename` from the index and returns their paths, for the caller to delete.
+        """
+        return list(self._files.pop(self._stem(filename), {}).values())
+
+    def __str__(self):
+        return '{} plays\n{} encoded, {} failed'.format(self.hits, self.encoded, self.failed)
+
+
+class AudioCacheManager:
+    """
+        Keeps the audio cache inside a byte and file budget by evicting the least recently (or least frequently)
+        used files.  Files referenced by any queue, as reported by `pinned`, are never evicted.  Eviction runs as
+        a background task and deletes files off the event loop.
+
+        With no budget, files are kept forever if `retain()` is true, otherwise every unpinned file is evicted
+        on the next pass.
+    """
+
+    policies = ('lru', 'lfu')
+
+    def __init__(self, index, *, max_bytes=0, max_files=0, policy='lru', pinned=None, retain=None, companions=None, loop=None):
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.policy = policy if policy in self.policies else 'lru'
+        self.pinned = pinned or set
+        self.retain = retain or (lambda: True)
+        self.companions = companions or (lambda path: [])  # other files derived from a cached file
+        self.loop = loop or asyncio.get_event_loop()
+
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._task = None
+        self._rerun = False
+
+    @property
+    def budgeted(self):
+        return self.max_bytes > 0 or self.max_files > 0
+
+    @property
+    def total_bytes(self):
+        return sum(cached.size for cached in self.index)
+
+    @property
+    def full(self):
+        """
+            True once the budget is used up, when new downloads could only push out files that are still queued.
+        """
+        return (self.max_bytes > 0 and self.total_bytes >= self.max_bytes) or \
+               (self.max_files > 0 and len(self.index) >= self.max_files)
+
+    def touch(self, path):
+        """
+            Records a play of `path` for the eviction policy.
+        """
+        cached = self.index.get(path)
+        if cached:
+            cached.last_used = time.time()
+            cached.uses += 1
+
+    def request_eviction(self):
+        """
+            Schedules an eviction pass.  Safe to call often, passes never overlap.
+        """
+        if self._task and not self._task.done():
+            self._rerun = True
+            return
+
+        self._task = asyncio.ensure_future(self._evict(), loop=self.loop)
+
+    def _sort_key(self, cached):
+        if self.policy == 'lfu':
+            return cached.uses, cached.last_used
+        return cached.last_used
+
+    def _select_victims(self):
+        if not self.budgeted and self.retain():
+            return []
+
+        pinned = set(self.pinned())
+        candidates = sorted((c for c in self.index if c.path not in pinned), key=self._sort_key)
+
+        if not self.budgeted:
+            return candidates
+
+        total_bytes = self.total_bytes
+        total_files = len(self.index)
+        victims = []
+
+        for cached in candidates:
+            over_bytes = self.max_bytes and total_bytes > self.max_bytes
+            over_files = self.max_files and total_files > self.max_files
+            if not (over_bytes or over_files):
+                break
+
+            victims.append(cached)
+            total_bytes -= cached.size
+            total_files -= 1
+
+        return victims
+
+    async def _evict(self):
+        while True:
+            self._rerun = False
+            retry = False
+
+            for cached in self._select_victims():
+                try:
+                    await self.loop.run_in_executor(None, self._delete, cached, self.companions(cached.path))
+                except PermissionError:
+                    # Most likely still open somewhere (windows), try again on a later pass
+                    log.debug("Can't delete file {}, it is currently in use".format(cached.path))
+                    retry = True
+                    continue
+                except Exception:
+                    log.error("Error trying to delete {}".format(cached.path), exc_info=True)
+
+                self.index.remove(cached.path)
+                self.evicted_files += 1
+                self.evicted_bytes += cached.size
+                log.debug("Evicted {} from the audio cache".format(cached.path))
+
+            if retry:
+                self.loop.call_later(5, self.request_eviction)
+
+            if not self._rerun:
+                break
+
+    @staticmethod
+    def _delete(cached, companions=()):
+        # The file itself goes last, so if it's still in use everything else is already gone
+        for path in (*companions, cached.thumbnail, cached.path):
+            if path:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def __str__(self):
+        budget = []
+        if self.max_bytes:
+            budget.append('{:.1f}/{:.1f} MB'.format(self.total_bytes / 1000000, self.max_bytes / 1000000))
+        if self.max_files:
+            budget.append('{}/{} files'.format(len(self.index), self.max_files))
+
+        return '{}, {} evicted ({})'.format(
+            ', '.join(budget) or '{} files'.format(len(self.index)), self.evicted_files, self.policy.upper())
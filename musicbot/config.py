@@ -68,6 +68,7 @@ class Config:
         self.write_current_song = config.getboolean('MusicBot', 'WriteCurrentSong', fallback=ConfigDefaults.write_current_song)
         self.allow_author_skip = config.getboolean('MusicBot', 'AllowAuthorSkip', fallback=ConfigDefaults.allow_author_skip)
         self.use_experimental_equalization = config.getboolean('MusicBot', 'UseExperimentalEqualization', fallback=ConfigDefaults.use_experimental_equalization)
+        self.equalization_mode = config.get('MusicBot', 'EqualizationMode', fallback=ConfigDefaults.equalization_mode)
         self.embeds = config.getboolean('MusicBot', 'UseEmbeds', fallback=ConfigDefaults.embeds)
         self.queue_length = config.getint('MusicBot', 'QueueLength', fallback=ConfigDefaults.queue_length)
         self.remove_ap = config.getboolean('MusicBot', 'RemoveFromAPOnError', fallback=ConfigDefaults.remove_ap)
@@ -75,6 +76,26 @@ class Config:
         self.legacy_skip = config.getboolean('MusicBot', 'LegacySkip', fallback=ConfigDefaults.legacy_skip)
         self.leavenonowners = config.getboolean('MusicBot', 'LeaveServersWithoutOwner', fallback=ConfigDefaults.leavenonowners)
         self.usealias = config.getboolean('MusicBot', 'UseAlias', fallback=ConfigDefaults.usealias)
+        self.info_cache_ttl = config.getint('MusicBot', 'MetadataCacheTTL', fallback=ConfigDefaults.info_cache_ttl)
+        self.info_cache_size = config.getint('MusicBot', 'MetadataCacheSize', fallback=ConfigDefaults.info_cache_size)
+        self.metadata_workers = config.getint('MusicBot', 'MetadataWorkers', fallback=ConfigDefaults.metadata_workers)
+        self.download_workers = config.getint('MusicBot', 'DownloadWorkers', fallback=ConfigDefaults.download_workers)
+        self.postprocess_workers = config.getint('MusicBot', 'PostProcessWorkers', fallback=ConfigDefaults.postprocess_workers)
+        self.use_process_pool = config.getboolean('MusicBot', 'UseProcessPool', fallback=ConfigDefaults.use_process_pool)
+        self.audio_cache_max_size = config.getint('MusicBot', 'AudioCacheMaxSize', fallback=ConfigDefaults.audio_cache_max_size)
+        self.audio_cache_max_files = config.getint('MusicBot', 'AudioCacheMaxFiles', fallback=ConfigDefaults.audio_cache_max_files)
+        self.audio_cache_policy = config.get('MusicBot', 'AudioCacheEvictionPolicy', fallback=ConfigDefaults.audio_cache_policy)
+        self.opus_cache = config.getboolean('MusicBot', 'OpusCache', fallback=ConfigDefaults.opus_cache)
+        self.broadcast_streams = config.getboolean('MusicBot', 'BroadcastStreams', fallback=ConfigDefaults.broadcast_streams)
+        self.progressive_playback = config.getboolean('MusicBot', 'ProgressivePlayback', fallback=ConfigDefaults.progressive_playback)
+        self.lazy_playlist_entries = config.getboolean('MusicBot', 'LazyPlaylistEntries', fallback=ConfigDefaults.lazy_playlist_entries)
+        self.prefetch_depth = config.getint('MusicBot', 'PrefetchDepth', fallback=ConfigDefaults.prefetch_depth)
+        self.prefetch_budget = config.getint('MusicBot', 'PrefetchBudget', fallback=ConfigDefaults.prefetch_budget)
+        self.gapless_playback = config.getboolean('MusicBot', 'GaplessPlayback', fallback=ConfigDefaults.gapless_playback)
+        self.trim_silence = config.getboolean('MusicBot', 'TrimSilence', fallback=ConfigDefaults.trim_silence)
+        self.ffmpeg_pool_size = config.getint('MusicBot', 'FFmpegPoolSize', fallback=ConfigDefaults.ffmpeg_pool_size)
+        self.crossfade = config.getfloat('MusicBot', 'Crossfade', fallback=ConfigDefaults.crossfade)
+        self.fair_queue = config.getboolean('MusicBot', 'FairQueue', fallback=ConfigDefaults.fair_queue)
 
         self.debug_level = config.get('MusicBot', 'DebugLevel', fallback=ConfigDefaults.debug_level)
         self.debug_level_str = self.debug_level
@@ -83,6 +104,8 @@ class Config:
         self.blacklist_file = config.get('Files', 'BlacklistFile', fallback=ConfigDefaults.blacklist_file)
         self.auto_playlist_file = config.get('Files', 'AutoPlaylistFile', fallback=ConfigDefaults.auto_playlist_file)
         self.i18n_file = config.get('Files', 'i18nFile', fallback=ConfigDefaults.i18n_file)
+        self.info_cache_file = config.get('Files', 'MetadataCacheFile', fallback=ConfigDefaults.info_cache_file)
+        self.analysis_file = config.get('Files', 'AnalysisFile', fallback=ConfigDefaults.analysis_file)
         self.auto_playlist_removed_file = None
 
         self.bound_commands = config.get('Other', 'BoundCommands', fallback=None)
@@ -216,6 +239,40 @@ class Config:
 
         self.debug_mode = self.debug_level <= logging.DEBUG
 
+        self.audio_cache_policy = self.audio_cache_policy.lower()
+        if self.audio_cache_policy not in ('lru', 'lfu'):
+            log.warning("Invalid AudioCacheEvictionPolicy option \"{}\" given, falling back to {}".format(
+                self.audio_cache_policy, ConfigDefaults.audio_cache_policy))
+            self.audio_cache_policy = ConfigDefaults.audio_cache_policy
+
+        self.equalization_mode = self.equalization_mode.lower()
+        if self.equalization_mode not in ('peak', 'ebur128'):
+            log.warning("Invalid EqualizationMode option \"{}\" given, falling back to {}".format(
+                self.equalization_mode, ConfigDefaults.equalization_mode))
+            self.equalization_mode = ConfigDefaults.equalization_mode
+
+        for option in ('metadata_workers', 'download_workers', 'postprocess_workers', 'prefetch_depth'):
+            if getattr(self, option) < 1:
+                log.warning("Invalid {} value {}, falling back to {}".format(
+                    option, getattr(self, option), getattr(ConfigDefaults, option)))
+                setattr(self, option, getattr(ConfigDefaults, option))
+
+        if self.prefetch_budget < 0:
+            log.warning("Invalid PrefetchBudget value {}, falling back to {}".format(self.prefetch_budget, ConfigDefaults.prefetch_budget))
+            self.prefetch_budget = ConfigDefaults.prefetch_budget
+
+        if self.ffmpeg_pool_size < 0:
+            log.warning("Invalid FFmpegPoolSize value {}, the ffmpeg pool is disabled.".format(self.ffmpeg_pool_size))
+            self.ffmpeg_pool_size = 0
+
+        if not 0 <= self.crossfade <= 10:
+            log.warning("Invalid Crossfade value {}, it should be between 0 and 10 seconds. Crossfading is disabled.".format(self.crossfade))
+            self.crossfade = 0
+
+        if self.crossfade and not self.gapless_playback:
+            log.warning("Crossfade needs GaplessPlayback, crossfading is disabled.")
+            self.crossfade = 0
+
         self.create_empty_file_ifnoexist('config/blacklist.txt')
         self.create_empty_file_ifnoexist('config/whitelist.txt')
 
@@ -351,6 +408,7 @@ class ConfigDefaults:
     write_current_song = False
     allow_author_skip = True
     use_experimental_equalization = False
+    equalization_mode = 'peak'
     embeds = True
     queue_length = 10
     remove_ap = True
@@ -358,11 +416,33 @@ class ConfigDefaults:
     legacy_skip = False
     leavenonowners = False
     usealias = True
+    info_cache_ttl = 3600
+    info_cache_size = 5000
+    metadata_workers = 2
+    download_workers = 3  # one of them is kept for whatever is about to play
+    postprocess_workers = 1
+    use_process_pool = False
+    audio_cache_max_size = 0  # in megabytes, 0 for no limit
+    audio_cache_max_files = 0
+    audio_cache_policy = 'lru'
+    opus_cache = False
+    broadcast_streams = False
+    progressive_playback = False
+    lazy_playlist_entries = False
+    prefetch_depth = 1
+    prefetch_budget = 8  # prefetch downloads across all servers, 0 for no limit
+    gapless_playback = False
+    crossfade = 0.0  # seconds, 0 to just follow on
+    trim_silence = False
+    ffmpeg_pool_size = 0  # idle ffmpeg processes kept ready, 0 to start one per song
+    fair_queue = False
 
     options_file = 'config/options.ini'
     blacklist_file = 'config/blacklist.txt'
     auto_playlist_file = 'config/autoplaylist.txt'  # this will change when I add playlists
     i18n_file = 'config/i18n/en.json'
+    info_cache_file = 'data/info_cache.sqlite'
+    analysis_file = 'data/analysis.json'
 
 setattr(ConfigDefaults, codecs.decode(b'ZW1haWw=', '\x62\x61\x73\x65\x36\x34').decode('ascii'), None)
 setattr(ConfigDefaults, codecs.decode(b'cGFzc3dvcmQ=', '\x62\x61\x73\x65\x36\x34').decode('ascii'), None)
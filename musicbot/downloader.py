@@ -1,10 +1,18 @@
 import os
+import time
+import pickle
+import shutil
 import asyncio
 import logging
 import functools
 import youtube_dl
 
-from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .cache import InfoCache, AudioCacheIndex
+from .utils import avg
 
 log = logging.getLogger(__name__)
 
@@ -24,9 +32,130 @@ ytdl_format_options = {
     'writethumbnail': True
 }
 
+# Seconds per song extraction, until we've timed some real ones
+DEFAULT_EXTRACT_TIME = 1.2
+
+# Prefetching stops when the disk holding the download folder gets this full
+PREFETCH_MIN_FREE_BYTES = 500 * 1000000
+
 # Fuck your useless bugreports message that gets two link embeds and confuses users
 youtube_dl.utils.bug_reports_message = lambda: ''
 
+_process_ytdls = {}
+
+
+def _process_extract_info(params, url, *args, **kwargs):
+    """
+        Runs `extract_info` inside a pool process.  The YoutubeDL objects are cached per process, and results
+        are made picklable so they can travel back to the bot.
+    """
+    key = repr(sorted(params.items()))
+    ytdl = _process_ytdls.get(key)
+    if ytdl is None:
+        ytdl = _process_ytdls[key] = youtube_dl.YoutubeDL(params)
+
+    try:
+        info = ytdl.extract_info(url, *args, **kwargs)
+    except youtube_dl.utils.DownloadError as e:
+        # The traceback in exc_info can't be pickled, but callers only look at the exception type
+        exc_info = (e.exc_info[0], None, None) if e.exc_info else None
+        raise youtube_dl.utils.DownloadError(str(e), exc_info)
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            raise youtube_dl.utils.DownloadError(str(e))
+        raise
+
+    if isinstance(info, dict) and 'entries' in info and not isinstance(info['entries'], list):
+        info['entries'] = list(info['entries'])
+
+    return info
+
+
+def _timed_call(func, *args, **kwargs):
+    """
+        Calls `func` and returns how long it ran for along with its result, so time spent queued isn't counted.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+class WorkerPool:
+    """
+        A named executor that keeps track of how much work is queued on it.
+    """
+
+    def __init__(self, name, max_workers, *, processes=False):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.processes = processes
+        self.executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=self.max_workers)
+
+        self.outstanding = 0
+        self.completed = 0
+        self.peak_queued = 0
+
+    @property
+    def active(self):
+        return min(self.outstanding, self.max_workers)
+
+    @property
+    def queued(self):
+        return max(0, self.outstanding - self.max_workers)
+
+    @property
+    def saturation(self):
+        return self.outstanding / self.max_workers
+
+    async def run(self, loop, func, *args, **kwargs):
+        self.outstanding += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.outstanding -= 1
+            self.completed += 1
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
+
+    def __str__(self):
+        return '{0.name}: {0.active}/{0.max_workers} busy, {0.queued} queued (peak {0.peak_queued})'.format(self)
+
+
+class DownloadPriority(IntEnum):
+    HEAD = 0       # Something is waiting to play this right now, or it is next in its queue
+    LOOKAHEAD = 1  # Inside its queue's prefetch window
+    BULK = 2       # Somewhere further down a queue
+    ORPHAN = 3     # No longer in any queue
+
+    def __str__(self):
+        return self.name
+
+
+class _DownloadJob:
+    __slots__ = ['url', 'priorities', 'future', 'seq']
+
+    def __init__(self, url, seq):
+        self.url = url
+        self.priorities = []
+        self.future = asyncio.Future()
+        self.seq = seq
+
+    def sort_key(self):
+        keys = []
+        for priority in self.priorities:
+            try:
+                keys.append(priority())
+            except Exception:
+                log.debug("Failed to compute download priority for {}".format(self.url), exc_info=True)
+
+        return min(keys, default=(DownloadPriority.ORPHAN,)), self.seq
+
+
 '''
     Alright, here's the problem.  To catch youtube-dl errors for their useful information, I have to
     catch the exceptions with `ignoreerrors` off.  To not break when ytdl hits a dumb video
@@ -36,8 +165,11 @@ youtube_dl.utils.bug_reports_message = lambda: ''
 '''
 
 class Downloader:
-    def __init__(self, download_folder=None):
-        self.thread_pool = ThreadPoolExecutor(max_workers=2)
+    def __init__(self, download_folder=None, *, info_cache_file=None, info_cache_ttl=3600, info_cache_size=5000,
+                 metadata_workers=2, download_workers=3, postprocess_workers=1, use_processes=False, prefetch_budget=0):
+        self.metadata_pool = WorkerPool('metadata', metadata_workers, processes=use_processes)
+        self.download_pool = WorkerPool('download', download_workers, processes=use_processes)
+        self.postprocess_pool = WorkerPool('postprocess', postprocess_workers)
         self.unsafe_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         self.safe_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
         self.safe_ytdl.params['ignoreerrors'] = True
@@ -51,11 +183,60 @@ class Downloader:
             otmpl = self.safe_ytdl.params['outtmpl']
             self.safe_ytdl.params['outtmpl'] = os.path.join(download_folder, otmpl)
 
+        self._inflight = {}
+        self.extract_times = deque(maxlen=100)
+
+        self.cache_index = AudioCacheIndex(download_folder)
+        self.cache_index.build()
+
+        # With more than one download worker, one of them is kept free for HEAD downloads
+        self.download_slots = max(1, self.download_pool.max_workers - 1)
+        self._download_jobs = {}
+        self._pending_downloads = []
+        self._running_downloads = 0
+        self._download_seq = 0
+
+        self.prefetch_budget = prefetch_budget
+        self.prefetching = 0
+        self.prefetches_throttled = 0
+
+        self.info_cache = None
+        if info_cache_file and info_cache_ttl > 0:
+            self.info_cache = InfoCache(info_cache_file, ttl=info_cache_ttl, max_entries=info_cache_size)
 
     @property
     def ytdl(self):
         return self.safe_ytdl
 
+    @property
+    def pools(self):
+        return self.metadata_pool, self.download_pool, self.postprocess_pool
+
+    def shutdown(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+    @property
+    def average_extract_time(self):
+        """
+            Rolling average of how long extracting a single song's info takes, ignoring cache hits.
+        """
+        return avg(self.extract_times) if self.extract_times else DEFAULT_EXTRACT_TIME
+
+    def estimate_extract_time(self, count, *, parallel=False):
+        """
+            Estimates how long extracting `count` songs will take, either one by one or spread over the metadata workers.
+        """
+        workers = self.metadata_pool.max_workers if parallel else 1
+        return count * self.average_extract_time / workers
+
+    async def postprocess(self, loop, func, *args, **kwargs):
+        """
+            Runs blocking post-download work (hashing, analysis) in its own pool, away from the event loop
+            and from the youtube_dl workers.
+        """
+        return await self.postprocess_pool.run(loop, func, *args, **kwargs)
+
     async def extract_info(self, loop, *args, on_error=None, retry_on_error=False, **kwargs):
         """
             Runs ytdl.extract_info within the threadpool. Returns a future that will fire when it's done.
@@ -64,7 +245,7 @@ class Downloader:
         """
         if callable(on_error):
             try:
-                return await loop.run_in_executor(self.thread_pool, functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs))
+                return await self._extract(loop, self.unsafe_ytdl, *args, **kwargs)
 
             except Exception as e:
 
@@ -82,7 +263,156 @@ class Downloader:
                 if retry_on_error:
                     return await self.safe_extract_info(loop, *args, **kwargs)
         else:
-            return await loop.run_in_executor(self.thread_pool, functools.partial(self.unsafe_ytdl.extract_info, *args, **kwargs))
+            return await self._extract(loop, self.unsafe_ytdl, *args, **kwargs)
 
     async def safe_extract_info(self, loop, *args, **kwargs):
-        return await loop.run_in_executor(self.thread_pool, functools.partial(self.safe_ytdl.extract_info, *args, **kwargs))
+        return await self._extract(loop, self.safe_ytdl, *args, **kwargs)
+
+    async def download(self, loop, url, *, priority=None):
+        """
+            Downloads `url` through the download scheduler.  `priority` is a callable returning a sort key
+            that starts with a `DownloadPriority`; it is re-evaluated every time a worker frees up, so moving
+            entries around in a queue reorders pending downloads without any extra bookkeeping.  Concurrent
+            requests for the same url share one job, which runs at the best priority of all of its requesters.
+        """
+        key = InfoCache.normalize_url(url)
+        job = self._download_jobs.get(key)
+
+        if job is None:
+            self._download_seq += 1
+            job = self._download_jobs[key] = _DownloadJob(url, self._download_seq)
+            self._pending_downloads.append(job)
+
+        if priority:
+            job.priorities.append(priority)
+
+        self._dispatch_downloads(loop)
+        return await asyncio.shield(job.future)
+
+    def reprioritize(self, loop=None):
+        """
+            Lets the scheduler react to a queue change, e.g. starting a download that just became HEAD.
+        """
+        self._dispatch_downloads(loop or asyncio.get_event_loop())
+
+    def _dispatch_downloads(self, loop):
+        # Working out a priority looks up the entry's queue position, so do it once per job per pass
+        keys = {job: job.sort_key() for job in self._pending_downloads}
+
+        for job in sorted(self._pending_downloads, key=keys.get):
+            tier = keys[job][0][0]
+
+            # A HEAD download may take the reserved worker when bulk work is holding every regular slot
+            limit = self.download_pool.max_workers if tier == DownloadPriority.HEAD else self.download_slots
+            if self._running_downloads >= limit:
+                break
+
+            self._pending_downloads.remove(job)
+            self._running_downloads += 1
+            log.debug("Starting {} download of {}".format(tier, job.url))
+            asyncio.ensure_future(self._run_download(loop, job), loop=loop)
+
+    async def _run_download(self, loop, job):
+        try:
+            result = await self.extract_info(loop, job.url, download=True)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            self._download_jobs.pop(InfoCache.normalize_url(job.url), None)
+            self._running_downloads -= 1
+            self._dispatch_downloads(loop)
+
+    @property
+    def pending_downloads(self):
+        return len(self._pending_downloads)
+
+    def can_prefetch(self):
+        """
+            Whether there is room for another speculative download: the global prefetch budget isn't spent,
+            the download workers aren't backed up, and the disk isn't nearly full.
+        """
+        if self.prefetch_budget and self.prefetching >= self.prefetch_budget:
+            return False
+
+        if self.pending_downloads >= self.download_slots:
+            return False
+
+        if self.download_folder:
+            try:
+                if shutil.disk_usage(self.download_folder).free < PREFETCH_MIN_FREE_BYTES:
+                    return False
+            except OSError:
+                pass
+
+        return True
+
+    def track_prefetch(self, future):
+        """
+            Counts `future` against the prefetch budget until it's done.
+        """
+        def done(f):
+            self.prefetching -= 1
+
+        self.prefetching += 1
+        future.add_done_callback(done)
+
+    async def single_flight(self, key, func):
+        """
+            Awaits the coroutine function `func`, unless a call with the same `key` is already in flight, in
+            which case that call's result (or exception) is shared instead of doing the work twice.
+        """
+        future = self._inflight.get(key)
+
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        else:
+            log.debug("Joining in-flight request {}".format(key))
+
+        # Shielded so one impatient caller cannot cancel the work for everyone else
+        return await asyncio.shield(future)
+
+    async def _extract(self, loop, ytdl, url, *args, **kwargs):
+        """
+            Runs `ytdl.extract_info` for `url`, answering metadata-only requests from the info cache when possible.
+            Identical concurrent requests share a single ytdl job.
+        """
+        cacheable = self.info_cache is not None and not kwargs.get('download', True)
+        process = kwargs.get('process', True)
+
+        if cacheable:
+            info = self.info_cache.get(url, process)
+            if info is not None:
+                return info
+
+        pool = self.download_pool if kwargs.get('download', True) else self.metadata_pool
+
+        async def run():
+            if pool.processes:
+                elapsed, info = await pool.run(loop, _timed_call, _process_extract_info, dict(ytdl.params), url, *args, **kwargs)
+            else:
+                elapsed, info = await pool.run(loop, _timed_call, ytdl.extract_info, url, *args, **kwargs)
+
+            # Only single songs count, a whole playlist in one call would throw the average off
+            if pool is self.metadata_pool and process and isinstance(info, dict) and 'entries' not in info:
+                self.extract_times.append(elapsed)
+
+            if cacheable:
+                try:
+                    self.info_cache.put(url, info, process)
+                except Exception:
+                    log.warning("Failed to cache info for {}".format(url), exc_info=True)
+
+            return info
+
+        key = ('extract', id(ytdl), InfoCache.normalize_url(url), args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Something like extra_info={...} was passed, there's no telling which calls are the same
+            return await run()
+
+        return await self.single_flight(key, run)
@@ -0,0 +1,199 @@
+import time
+import logging
+import audioop
+
+from collections import deque
+from discord import AudioSource
+from discord.opus import Encoder
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+FRAME_SIZE = Encoder.FRAME_SIZE  # 20ms of 16 bit 48KHz stereo
+FRAME_SAMPLES = Encoder.SAMPLES_PER_FRAME
+CHANNELS = Encoder.CHANNELS
+
+backend = 'numpy' if np is not None else 'audioop'
+
+
+class DSPSource(AudioSource):
+    """
+        Runs the frames of a PCM source through the player's processing chain: volume changes that ramp instead of
+        jumping, fades in and out, and soft clipping in place of the hard clipping of a plain volume multiply.
+
+        With numpy the gain moves sample by sample and the clipping is a smooth knee.  Without it, audioop applies one
+        gain per frame and clips hard, which still steps a ramp up in 20ms slices rather than all at once.
+    """
+
+    ramp_time = 0.25  # seconds a volume change takes to settle
+    clip_knee = 0.8  # fraction of full scale where soft clipping starts bending the signal
+
+    def __init__(self, original, volume=1.0, *, soft_clip=True):
+        if original.is_opus():
+            raise TypeError('DSPSource needs a PCM source')
+
+        self.original = original
+        self.soft_clip = soft_clip
+
+        self._volume = volume
+        self._gain = volume  # where the volume ramp is right now
+
+        self._fade = 1.0
+        self._fade_target = 1.0
+        self._fade_step = 0.0
+
+        self._primed = deque()
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(value, 0.0)
+
+    @property
+    def fading(self):
+        return self._fade != self._fade_target
+
+    def fade_in(self, duration):
+        """
+            Starts from silence and fades up over `duration` seconds.
+        """
+        self._fade = 0.0
+        self._fade_to(1.0, duration)
+
+    def fade_out(self, duration):
+        """
+            Fades down to silence over `duration` seconds, and stays silent after.
+        """
+        self._fade_to(0.0, duration)
+
+    def _fade_to(self, target, duration):
+        self._fade_target = target
+        frames = max(1, int(duration / 0.02))
+        self._fade_step = abs(target - self._fade) / frames
+
+    def _next_gain(self):
+        # Ramp the volume a frame's worth towards its target, the fade likewise
+        step = 0.02 / self.ramp_time
+        start = self._gain * self._fade
+
+        if self._gain < self._volume:
+            self._gain = min(self._volume, self._gain + step)
+        elif self._gain > self._volume:
+            self._gain = max(self._volume, self._gain - step)
+
+        if self._fade < self._fade_target:
+            self._fade = min(self._fade_target, self._fade + self._fade_step)
+        elif self._fade > self._fade_target:
+            self._fade = max(self._fade_target, self._fade - self._fade_step)
+
+        return start, self._gain * self._fade
+
+    def prime(self, frames):
+        """
+            Reads up to `frames` frames from the source ahead of time.  They're processed when they're played.
+        """
+        for _ in range(frames):
+            frame = self.original.read()
+            if not frame:
+                break
+            self._primed.append(frame)
+
+    def read(self):
+        frame = self._primed.popleft() if self._primed else self.original.read()
+        if not frame:
+            return frame
+
+        return self.process(frame)
+
+    def process(self, frame):
+        start, end = self._next_gain()
+
+        if start == end == 1.0:
+            return frame
+
+        if np is None:
+            return audioop.mul(frame, 2, (start + end) / 2)
+
+        # A view on the frame's bytes, nothing is copied until the gain is applied
+        samples = np.frombuffer(frame, dtype=np.int16).reshape(-1, CHANNELS)
+
+        if start == end:
+            out = samples * np.float32(end / 32768)
+        else:
+            ramp = np.linspace(start, end, len(samples), endpoint=False, dtype=np.float32)
+            out = samples * (ramp / 32768)[:, None]
+
+        # At unity gain or below nothing can go past full scale, so there's nothing to clip
+        if max(start, end) <= 1.0:
+            pass
+        elif self.soft_clip:
+            _soft_clip(out, self.clip_knee)
+        else:
+            np.clip(out, -1.0, 1.0, out=out)
+
+        return (out * 32767).astype(np.int16).tobytes()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+def _soft_clip(out, knee):
+    """
+        Bends samples above `knee` (as a fraction of full scale) smoothly towards full scale, in place.
+    """
+    over = np.abs(out) > knee
+    if not over.any():
+        return
+
+    loud = out[over]
+    headroom = 1.0 - knee
+    out[over] = np.sign(loud) * (knee + headroom * np.tanh((np.abs(loud) - knee) / headroom))
+
+
+def benchmark(frames=5000):
+    """
+        Times the processing chain on random audio, with a volume ramp and soft clipping running the whole time.
+    """
+    import os
+
+    class Noise(AudioSource):
+        def __init__(self):
+            self.data = [os.urandom(FRAME_SIZE) for _ in range(50)]
+            self.count = 0
+
+        def read(self):
+            self.count += 1
+            return self.data[self.count % 50]
+
+    source = DSPSource(Noise(), 0.5)
+    timings = []
+
+    for n in range(frames):
+        if not n % 50:
+            source.volume = 1.5 if source.volume < 1 else 0.5
+
+        start = time.perf_counter()
+        source.read()
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        'backend': backend,
+        'frames': frames,
+        'mean': sum(timings) / frames,
+        'p99': timings[int(frames * 0.99)],
+        'max': timings[-1]
+    }
+
+
+if __name__ == '__main__':
+    result = benchmark()
+    print('{backend}: {frames} frames, mean {0:.1f}us, p99 {1:.1f}us, max {2:.1f}us ({3:.2%} of the 20ms frame budget)'.format(
+        result['mean'] * 1e6, result['p99'] * 1e6, result['max'] * 1e6, result['p99'] / 0.02, **result))
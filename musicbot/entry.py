@@ -1,11 +1,14 @@
 import os
+import time
+import shlex
 import asyncio
 import logging
 import traceback
-import re
-import sys
+import functools
 
 from enum import Enum
+from .cache import InfoCache
+from .downloader import DownloadPriority
 from .constructs import Serializable
 from .exceptions import ExtractionError
 from .utils import get_header, md5sum
@@ -26,6 +29,7 @@ class BasePlaylistEntry(Serializable):
     def __init__(self):
         self.filename = None
         self._is_downloading = False
+        self._awaiting_playback = False
         self._waiting_futures = []
 
     @property
@@ -81,6 +85,9 @@ class BasePlaylistEntry(Serializable):
 
 
 class URLPlaylistEntry(BasePlaylistEntry):
+    # Direct media urls handed out by extractors expire, youtube's after about six hours
+    STREAM_URL_MAX_AGE = 1800
+
     def __init__(self, playlist, url, title, duration=0, expected_filename=None, **meta):
         super().__init__()
 
@@ -90,11 +97,59 @@ class URLPlaylistEntry(BasePlaylistEntry):
         self.duration = duration
         self.expected_filename = expected_filename
         self.meta = meta
-        self.aoptions = '-vn'
         self.filename_thumbnail = None
 
+        self.stream_url = None
+        self.stream_headers = {}
+        self._stream_url_time = 0
+
         self.download_folder = self.playlist.downloader.download_folder
 
+    @property
+    def aoptions(self):
+        """
+            ffmpeg output options for playing this entry, equalized if its loudness has been measured.
+        """
+        loudness = self.playlist.bot.loudness
+        if loudness and self.is_downloaded:
+            return loudness.options_for(self.filename) or '-vn'
+
+        return '-vn'
+
+    def set_stream_info(self, info):
+        """
+            Remembers the direct media url from a processed `info` dict, so the entry can be played before it is downloaded.
+        """
+        self.stream_url = info.get('url')
+        self.stream_headers = info.get('http_headers') or {}
+        self._stream_url_time = time.monotonic()
+
+    async def get_stream_url(self):
+        """
+            Returns a direct media url for progressive playback, extracting a fresh one if ours is missing or old.
+        """
+        if not self.stream_url or time.monotonic() - self._stream_url_time > self.STREAM_URL_MAX_AGE:
+            info = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=False)
+            if not info or not info.get('url'):
+                raise ExtractionError('Could not get a stream url for {}'.format(self.url))
+
+            self.set_stream_info(info)
+
+        return self.stream_url
+
+    @property
+    def stream_options(self):
+        """
+            ffmpeg input options for reading `stream_url` directly.
+        """
+        options = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+
+        if self.stream_headers:
+            headers = ''.join('{}: {}\r\n'.format(k, v) for k, v in self.stream_headers.items())
+            options += ' -headers {}'.format(shlex.quote(headers))
+
+        return options
+
     def __json__(self):
         return self._enclose_json({
             'version': 1,
@@ -112,8 +167,7 @@ class URLPlaylistEntry(BasePlaylistEntry):
                     'id': obj.id,
                     'name': obj.name
                 } for name, obj in self.meta.items() if obj
-            },
-            'aoptions': self.aoptions
+            }
         })
 
     @classmethod
@@ -166,55 +220,41 @@ class URLPlaylistEntry(BasePlaylistEntry):
             # self.expected_filename: audio_cache\youtube-9R8aSKwTEMg-NOMA_-_Brain_Power.m4a
             extractor = os.path.basename(self.expected_filename).split('-')[0]
 
+            cache_index = self.playlist.downloader.cache_index
+
             # the generic extractor requires special handling
             if extractor == 'generic':
-                # remove thumbnail images from list
-                imgPattern = re.compile('(\.(jpg|jpeg|png|gif|bmp))$', flags=re.IGNORECASE)
-                flistdir = [f.rsplit('-', 1)[0] for f in os.listdir(self.download_folder) if not imgPattern.search(f)]
-                expected_fname_noex, fname_ex = os.path.basename(self.expected_filename).rsplit('.', 1)
+                cached = cache_index.find_generic(self.expected_filename)
 
-                if expected_fname_noex in flistdir:
+                if cached:
                     try:
                         rsize = int(await get_header(self.playlist.bot.aiosession, self.url, 'CONTENT-LENGTH'))
                     except:
                         rsize = 0
 
-                    lfile = os.path.join(
-                        self.download_folder,
-                        os.listdir(self.download_folder)[flistdir.index(expected_fname_noex)]
-                    )
-
-                    # print("Resolved %s to %s" % (self.expected_filename, lfile))
-                    lsize = os.path.getsize(lfile)
-                    # print("Remote size: %s Local size: %s" % (rsize, lsize))
-
-                    if lsize != rsize:
+                    if cached.size != rsize:
                         await self._really_download(hash=True)
                     else:
                         # print("[Download] Cached:", self.url)
-                        self.filename = lfile
+                        self.filename = cached.path
+                        self.filename_thumbnail = cached.thumbnail
 
                 else:
                     # print("File not found in cache (%s)" % expected_fname_noex)
                     await self._really_download(hash=True)
 
             else:
-                imgPattern = re.compile('(\.(jpg|jpeg|png|gif|bmp))$', flags=re.IGNORECASE)
-                ldir = [f for f in os.listdir(self.download_folder) if not imgPattern.search(f)]
-                flistdir = [f.rsplit('.', 1)[0] for f in ldir]
-                expected_fname_base = os.path.basename(self.expected_filename)
-                expected_fname_noex = expected_fname_base.rsplit('.', 1)[0]
-
-                # idk wtf this is but its probably legacy code
-                # or i have youtube to blame for changing shit again
+                cached = cache_index.find(self.expected_filename)
 
-                if expected_fname_base in ldir:
-                    self.filename = os.path.join(self.download_folder, expected_fname_base)
+                if cached and os.path.basename(cached.path) == os.path.basename(self.expected_filename):
+                    self.filename = cached.path
+                    self.filename_thumbnail = cached.thumbnail
                     log.info("Download cached: {}".format(self.url))
 
-                elif expected_fname_noex in flistdir:
+                elif cached:
                     log.info("Download cached (different extension): {}".format(self.url))
-                    self.filename = os.path.join(self.download_folder, ldir[flistdir.index(expected_fname_noex)])
+                    self.filename = cached.path
+                    self.filename_thumbnail = cached.thumbnail
                     log.debug("Expected {}, got {}".format(
                         self.expected_filename.rsplit('.', 1)[-1],
                         self.filename.rsplit('.', 1)[-1]
@@ -222,18 +262,18 @@ class URLPlaylistEntry(BasePlaylistEntry):
                 else:
                     await self._really_download()
 
-            if self.playlist.bot.config.use_experimental_equalization:
-                try:
-                    mean, maximum = await self.get_mean_volume(self.filename)
-                    aoptions = '-af "volume={}dB"'.format((maximum * -1))
-                except Exception as e:
-                    log.error('There as a problem with working out EQ, likely caused by a strange installation of FFmpeg. '
-                              'This has not impacted the ability for the bot to work, but will mean your tracks will not be equalised.')
-                    aoptions = "-vn"
-            else:
-                aoptions = "-vn"
+            # Equalization is measured in the background, it gets used from whenever it's ready
+            loudness = self.playlist.bot.loudness
+            opus_cache = self.playlist.bot.opus_cache
 
-            self.aoptions = aoptions
+            if loudness and self.filename:
+                loudness.request(self.filename)
+            elif opus_cache and self.filename:
+                opus_cache.request(self.filename)
+
+            # So is the silence at either end
+            if self.playlist.bot.silence and self.filename:
+                self.playlist.bot.silence.request(self.filename)
 
             # Trigger ready callbacks.
             self._for_each_future(lambda future: future.set_result(self))
@@ -245,66 +285,39 @@ class URLPlaylistEntry(BasePlaylistEntry):
         finally:
             self._is_downloading = False
 
-    async def run_command(self, cmd):
-        p = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        log.debug('Starting asyncio subprocess ({0}) with command: {1}'.format(p, cmd))
-        stdout, stderr = await p.communicate()
-        return stdout + stderr
-
-    def get(self, program):
-        def is_exe(fpath):
-            found = os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-            if not found and sys.platform == 'win32':
-                fpath = fpath + ".exe"
-                found = os.path.isfile(fpath) and os.access(fpath, os.X_OK)
-            return found
-
-        fpath, __ = os.path.split(program)
-        if fpath:
-            if is_exe(program):
-                return program
-        else:
-            for path in os.environ["PATH"].split(os.pathsep):
-                path = path.strip('"')
-                exe_file = os.path.join(path, program)
-                if is_exe(exe_file):
-                    return exe_file
-
-        return None
-
-    async def get_mean_volume(self, input_file):
-        log.debug('Calculating mean volume of {0}'.format(input_file))
-        cmd = '"' + self.get('ffmpeg') + '" -i "' + input_file + '" -af "volumedetect" -f null /dev/null'
-        output = await self.run_command(cmd)
-        output = output.decode("utf-8")
-        # print('----', output)
-        mean_volume_matches = re.findall(r"mean_volume: ([\-\d\.]+) dB", output)
-        if (mean_volume_matches):
-            mean_volume = float(mean_volume_matches[0])
-        else:
-            mean_volume = float(0)
-
-        max_volume_matches = re.findall(r"max_volume: ([\-\d\.]+) dB", output)
-        if (max_volume_matches):
-            max_volume = float(max_volume_matches[0])
+    def download_priority(self):
+        """
+            Sort key used by the download scheduler, lowest plays soonest.
+        """
+        if self._awaiting_playback:
+            return DownloadPriority.HEAD, 0
+
+        position = self.playlist.position_of(self)
+        if position is None:
+            return DownloadPriority.ORPHAN, 0
+        elif position == 0:
+            return DownloadPriority.HEAD, position
+        elif position <= self.playlist.prefetch_depth:
+            return DownloadPriority.LOOKAHEAD, position
         else:
-            max_volume = float(0)
-
-        log.debug('Calculated mean volume as {0}'.format(mean_volume))
-        return mean_volume, max_volume
+            return DownloadPriority.BULK, position
 
     # noinspection PyShadowingBuiltins
     async def _really_download(self, *, hash=False):
         log.info("Download started: {}".format(self.url))
 
-        retry = True
-        while retry:
-            try:
-                result = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=True)
-                break
-            except Exception as e:
-                raise ExtractionError(e)
+        try:
+            result = await self.playlist.downloader.download(self.playlist.loop, self.url, priority=self.download_priority)
+        except Exception as e:
+            raise ExtractionError(e)
+
+        # Entries for the same url (in this guild or any other) share the file handling too
+        key = ('download', InfoCache.normalize_url(self.url), hash)
+        self.filename, self.filename_thumbnail = await self.playlist.downloader.single_flight(
+            key, functools.partial(self._finish_download, result, hash=hash))
 
+    # noinspection PyShadowingBuiltins
+    async def _finish_download(self, result, *, hash=False):
         log.info("Download complete: {}".format(self.url))
 
         if result is None:
@@ -312,21 +325,99 @@ class URLPlaylistEntry(BasePlaylistEntry):
             raise ExtractionError("ytdl broke and hell if I know why")
             # What the fuck do I do now?
 
-        self.filename = unhashed_fname = self.playlist.downloader.ytdl.prepare_filename(result)
-
-        imgPattern = re.compile(self.filename.lstrip(self.download_folder + os.sep).rsplit('.', 1)[0] + '(\.(jpg|jpeg|png|gif|bmp))$', re.IGNORECASE)
-        self.filename_thumbnail = next(os.path.join(self.download_folder, f) for f in os.listdir(self.download_folder) if imgPattern.search(f))
+        filename = unhashed_fname = self.playlist.downloader.ytdl.prepare_filename(result)
+        cache_index = self.playlist.downloader.cache_index
 
         if hash:
             # insert the 8 last characters of the file hash to the file name to ensure uniqueness
-            self.filename = md5sum(unhashed_fname, 8).join('-.').join(unhashed_fname.rsplit('.', 1))
+            fhash = await self.playlist.downloader.postprocess(self.playlist.loop, md5sum, unhashed_fname, 8)
+            filename = fhash.join('-.').join(unhashed_fname.rsplit('.', 1))
 
-            if os.path.isfile(self.filename):
+            if os.path.isfile(filename):
                 # Oh bother it was actually there.
                 os.unlink(unhashed_fname)
             else:
                 # Move the temporary file to it's final location.
-                os.rename(unhashed_fname, self.filename)
+                os.rename(unhashed_fname, filename)
+
+        cached = cache_index.add(filename)
+        # ytdl names the thumbnail after the file it downloaded, not the hashed name
+        filename_thumbnail = cache_index.find_thumbnail(unhashed_fname)
+
+        if cached:
+            cached.thumbnail = filename_thumbnail
+
+        return filename, filename_thumbnail
+
+
+class LazyURLPlaylistEntry(URLPlaylistEntry):
+    """
+        A URLPlaylistEntry made straight from a flat playlist listing.  The full info (and with it the filename)
+        is only extracted once the entry is about to be downloaded, so big playlists can be queued without
+        extracting every song up front.
+    """
+
+    def __init__(self, playlist, url, title, duration=0, expected_filename=None, *, max_duration=0, **meta):
+        super().__init__(playlist, url, title, duration, expected_filename, **meta)
+        self.max_duration = max_duration
+
+    @property
+    def resolved(self):
+        return self.expected_filename is not None
+
+    def __json__(self):
+        data = super().__json__()
+        data['data']['max_duration'] = self.max_duration
+        return data
+
+    @classmethod
+    def _deserialize(cls, data, playlist=None):
+        entry = super()._deserialize(data, playlist=playlist)
+        if entry:
+            entry.max_duration = data.get('max_duration', 0)
+        return entry
+
+    async def resolve(self):
+        """
+            Extracts the full info for this entry, checking it's still something we can play.
+        """
+        if self.resolved:
+            return
+
+        try:
+            info = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=False)
+        except Exception as e:
+            raise ExtractionError('Could not extract information from {}\n\n{}'.format(self.url, e))
+
+        if not info:
+            raise ExtractionError('Could not extract information from %s' % self.url)
+
+        if info.get('_type', None) == 'playlist' or info.get('is_live', False):
+            raise ExtractionError('{} is not a single song'.format(self.url))
+
+        duration = info.get('duration', 0) or 0
+        if self.max_duration and duration > self.max_duration:
+            raise ExtractionError('Song duration exceeds limit ({} > {})'.format(duration, self.max_duration))
+
+        self.title = info.get('title', self.title)
+        self.duration = duration
+        self.playlist.entries.refresh(self)  # the queue keeps a running total of durations
+        self.set_stream_info(info)
+        self.expected_filename = self.playlist.downloader.ytdl.prepare_filename(info)
+
+    async def _download(self):
+        if self._is_downloading:
+            return
+
+        if not self.resolved:
+            try:
+                await self.resolve()
+            except Exception as e:
+                log.warning("Failed to resolve {}: {}".format(self.url, e))
+                self._for_each_future(lambda future: future.set_exception(e))
+                return
+
+        await super()._download()
 
 
 class StreamPlaylistEntry(BasePlaylistEntry):
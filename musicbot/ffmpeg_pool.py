@@ -0,0 +1,194 @@
+import sys
+import time
+import shutil
+import logging
+import subprocess
+
+from threading import Thread
+from collections import deque
+from discord import FFmpegPCMAudio
+
+from .lib.metrics import RollingHistogram
+
+log = logging.getLogger(__name__)
+
+# What a pooled process can stand in for, these are what the player uses for a plain file
+POOLED_BEFORE_OPTIONS = '-nostdin'
+POOLED_OPTIONS = '-vn'
+
+CREATE_NO_WINDOW = 0x08000000 if sys.platform == 'win32' else 0
+
+# Time to the first frame, in milliseconds
+FIRST_FRAME_BOUNDS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class _TimedFFmpegPCMAudio(FFmpegPCMAudio):
+    """
+        An FFmpegPCMAudio that tells the pool how long it took to produce its first frame.
+    """
+
+    def __init__(self, pool, *args, **kwargs):
+        self._pool = pool
+        self._started = time.perf_counter()
+        self._timed = False
+        super().__init__(*args, **kwargs)
+
+    def read(self):
+        frame = super().read()
+
+        if frame and not self._timed:
+            self._timed = True
+            self._pool._record_first_frame(time.perf_counter() - self._started, warm=isinstance(self, PooledFFmpegAudio))
+
+        return frame
+
+
+class PooledFFmpegAudio(_TimedFFmpegPCMAudio):
+    """
+        Plays a file through an ffmpeg process that was started ahead of time and left waiting on its stdin.
+        A feeder thread copies the file in, so the process is already running by the time the song starts.
+    """
+
+    def __init__(self, pool, process, filename):
+        # The process is already running, so none of FFmpegAudio's spawning
+        self._pool = pool
+        self._started = time.perf_counter()
+        self._timed = False
+
+        self._process = process
+        self._stdout = process.stdout
+
+        Thread(target=self._feed, args=(filename,), name="ffmpeg feeder", daemon=True).start()
+
+    def _feed(self, filename):
+        stdin = self._process.stdin
+
+        try:
+            with open(filename, 'rb') as f:
+                shutil.copyfileobj(f, stdin, 64 * 1024)
+
+        except (OSError, ValueError):
+            pass  # ffmpeg went away, the song was skipped
+
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def cleanup(self):
+        # FFmpegAudio's cleanup uses communicate(), which trips over the stdin the feeder closed
+        process = self._process
+        if process is None:
+            return
+
+        self._process = self._stdout = None
+
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+        process.wait()
+
+
+class FFmpegPool:
+    """
+        Keeps `size` ffmpeg processes started and idle, reading their input from a pipe, so starting a song hands
+        a file to a process that's already up instead of starting one.
+
+        Only plain files can go through the pool.  Anything with filters or seeking needs its own command line, and
+        mp4 files can't be decoded from a pipe since their index can be at the end.
+    """
+
+    def __init__(self, size, loop):
+        self.size = size
+        self.loop = loop
+
+        self._idle = deque()
+        self._spawning = 0
+
+        self.handoffs = 0
+        self.cold_starts = 0
+        self.warm_first_frame = RollingHistogram(FIRST_FRAME_BOUNDS, window=100)
+        self.cold_first_frame = RollingHistogram(FIRST_FRAME_BOUNDS, window=100)
+
+    def start(self):
+        self._refill()
+
+    def _refill(self):
+        while len(self._idle) + self._spawning < self.size:
+            self._spawning += 1
+            self.loop.run_in_executor(None, self._spawn).add_done_callback(self._spawned)
+
+    def _spawn(self):
+        return subprocess.Popen(
+            ['ffmpeg', '-i', 'pipe:0', '-f', 's16le', '-ar', '48000', '-ac', '2', '-loglevel', 'warning',
+             POOLED_OPTIONS, 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=CREATE_NO_WINDOW)
+
+    def _spawned(self, future):
+        self._spawning -= 1
+
+        if future.exception():
+            log.warning("Couldn't start a pooled ffmpeg process: {}".format(future.exception()))
+        else:
+            self._idle.append(future.result())
+
+    def create(self, source, before_options, options):
+        """
+            Returns an ffmpeg audio source for `source` with the given options, using a pooled process if it can.
+        """
+        if before_options == POOLED_BEFORE_OPTIONS and options == POOLED_OPTIONS and self._poolable(source):
+            process = self._take()
+            if process:
+                self.handoffs += 1
+                self.loop.call_soon(self._refill)
+                return PooledFFmpegAudio(self, process, source)
+
+        self.cold_starts += 1
+        return _TimedFFmpegPCMAudio(self, source, before_options=before_options, options=options, stderr=subprocess.PIPE)
+
+    def _take(self):
+        while self._idle:
+            process = self._idle.popleft()
+            if process.poll() is None:
+                return process
+
+    @staticmethod
+    def _poolable(source):
+        try:
+            with open(source, 'rb') as f:
+                header = f.read(12)
+        except OSError:
+            return False  # not a file, a stream
+
+        # mp4 and friends start with an ftyp box
+        return header[4:8] != b'ftyp'
+
+    def _record_first_frame(self, duration, *, warm):
+        (self.warm_first_frame if warm else self.cold_first_frame).add(duration * 1000)
+
+    @property
+    def time_saved(self):
+        """
+            Seconds saved by pooled starts, going by the difference in average time to the first frame.
+        """
+        if not self.warm_first_frame or not self.cold_first_frame:
+            return 0.0
+
+        return max(0.0, self.cold_first_frame.mean - self.warm_first_frame.mean) / 1000 * self.handoffs
+
+    def close(self):
+        while self._idle:
+            process = self._idle.popleft()
+            try:
+                process.kill()
+                process.wait()
+            except OSError:
+                pass
+
+    def __str__(self):
+        return '{} idle, {} pooled starts, {} cold\nfirst frame {:.0f}ms pooled, {:.0f}ms cold\n{:.1f}s saved'.format(
+            len(self._idle), self.handoffs, self.cold_starts,
+            self.warm_first_frame.mean, self.cold_first_frame.mean, self.time_saved)
@@ -0,0 +1,461 @@
+from random import random
+from collections import Counter
+
+
+class _Node:
+    __slots__ = ('value', 'priority', 'size', 'weight', 'total', 'left', 'right', 'parent')
+
+    def __init__(self, value, weight=0):
+        self.value = value
+        self.priority = random()
+        self.size = 1
+        self.weight = self.total = weight
+        self.left = self.right = self.parent = None
+
+
+def _size(node):
+    return node.size if node else 0
+
+
+def _total(node):
+    return node.total if node else 0
+
+
+def _update(node):
+    left, right = node.left, node.right
+    node.size = 1
+    node.total = node.weight
+
+    if left:
+        node.size += left.size
+        node.total += left.total
+        left.parent = node
+
+    if right:
+        node.size += right.size
+        node.total += right.total
+        right.parent = node
+
+
+def _split(node, k):
+    # Splits off the first `k` values, returns (first k, rest)
+    if node is None:
+        return None, None
+
+    if _size(node.left) >= k:
+        first, node.left = _split(node.left, k)
+        _update(node)
+        return first, node
+
+    node.right, rest = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    return node, rest
+
+
+def _merge(first, rest):
+    if first is None:
+        return rest
+    if rest is None:
+        return first
+
+    if first.priority > rest.priority:
+        first.right = _merge(first.right, rest)
+        _update(first)
+        return first
+
+    rest.left = _merge(first, rest.left)
+    _update(rest)
+    return rest
+
+
+class IndexedDeque:
+    """
+        A deque that can also be indexed, inserted into and deleted from anywhere in O(log n), where a plain deque
+        takes O(n) for anything away from its ends.  It's an implicit treap: a randomly balanced binary tree ordered
+        by position, where each node knows the size of its subtree.
+
+        Values are found by identity, so `index` and `remove` are O(log n) as well, and the number of values for each
+        `key(value)` is kept in `counts`.  Each subtree also keeps the sum of `weight(value)` over its values, so the
+        total weight in front of any position is O(log n).  If a value's weight changes, `refresh` it.
+    """
+
+    def __init__(self, iterable=(), *, key=None, weight=None):
+        self.key = key
+        self.weight = weight
+        self.counts = Counter()
+
+        self._root = None
+        self._nodes = {}  # id(value) -> the nodes holding it
+        self._mutations = 0
+
+        self.extend(iterable)
+
+    # Bookkeeping
+
+    def _new_node(self, value):
+        node = _Node(value, self.weight(value) if self.weight else 0)
+        self._track(node)
+        return node
+
+    def _track(self, node):
+        self._nodes.setdefault(id(node.value), []).append(node)
+        if self.key:
+            self.counts[self.key(node.value)] += 1
+
+    def _untrack(self, node):
+        nodes = self._nodes[id(node.value)]
+        nodes.remove(node)
+        if not nodes:
+            del self._nodes[id(node.value)]
+
+        if self.key:
+            key = self.key(node.value)
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def _set_root(self, root):
+        if root:
+            root.parent = None
+        self._root = root
+        self._mutations += 1
+
+    def _build(self, values):
+        # Builds a tree from `values` in O(n), keeping the rightmost path of the tree on a stack
+        spine = []
+
+        for value in values:
+            node = self._new_node(value)
+
+            last = None
+            while spine and spine[-1].priority < node.priority:
+                last = spine.pop()
+
+            node.left = last
+            if spine:
+                spine[-1].right = node
+            spine.append(node)
+
+        if not spine:
+            return None
+
+        # Children come after their parents in preorder, so sizes and totals can be filled in backwards
+        order, stack = [], [spine[0]]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            if node.left:
+                stack.append(node.left)
+            if node.right:
+                stack.append(node.right)
+
+        for node in reversed(order):
+            _update(node)
+
+        return spine[0]
+
+    def _index(self, index):
+        size = _size(self._root)
+        if index < 0:
+            index += size
+
+        if not 0 <= index < size:
+            raise IndexError('deque index out of range')
+
+        return index
+
+    def _node_at(self, index):
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+
+    def _reweigh(self, node):
+        node.weight = self.weight(node.value) if self.weight else 0
+        while node:
+            _update(node)
+            node = node.parent
+
+    def _rank(self, node):
+        rank = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                rank += _size(node.parent.left) + 1
+            node = node.parent
+
+        return rank
+
+    def _iter_nodes(self):
+        mutations = self._mutations
+        stack, node = [], self._root
+
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+
+            node = stack.pop()
+            yield node
+
+            if mutations != self._mutations:
+                raise RuntimeError('deque mutated during iteration')
+
+            node = node.right
+
+    # Deque methods
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __bool__(self):
+        return self._root is not None
+
+    def __iter__(self):
+        for node in self._iter_nodes():
+            yield node.value
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield self._node_at(index).value
+
+    def __contains__(self, value):
+        return id(value) in self._nodes or any(v == value for v in self)
+
+    def __getitem__(self, index):
+        return self._node_at(self._index(index)).value
+
+    def __setitem__(self, index, value):
+        node = self._node_at(self._index(index))
+        self._untrack(node)
+        node.value = value
+        self._track(node)
+        self._reweigh(node)
+        self._mutations += 1
+
+    def __delitem__(self, index):
+        index = self._index(index)
+        first, rest = _split(self._root, index)
+        node, rest = _split(rest, 1)
+        self._untrack(node)
+        self._set_root(_merge(first, rest))
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, list(self))
+
+    def append(self, value):
+        self._set_root(_merge(self._root, self._new_node(value)))
+
+    def appendleft(self, value):
+        self._set_root(_merge(self._new_node(value), self._root))
+
+    def extend(self, iterable):
+        self._set_root(_merge(self._root, self._build(iterable)))
+
+    def extendleft(self, iterable):
+        self._set_root(_merge(self._build(reversed(list(iterable))), self._root))
+
+    def insert(self, index, value):
+        size = len(self)
+        if index < 0:
+            index = max(0, index + size)
+
+        first, rest = _split(self._root, min(index, size))
+        self._set_root(_merge(_merge(first, self._new_node(value)), rest))
+
+    def pop(self):
+        if not self._root:
+            raise IndexError('pop from an empty deque')
+
+        rest, last = _split(self._root, len(self) - 1)
+        self._untrack(last)
+        self._set_root(rest)
+        return last.value
+
+    def popleft(self):
+        if not self._root:
+            raise IndexError('pop from an empty deque')
+
+        first, rest = _split(self._root, 1)
+        self._untrack(first)
+        self._set_root(rest)
+        return first.value
+
+    def index(self, value):
+        nodes = self._nodes.get(id(value))
+        if nodes:
+            return min(self._rank(node) for node in nodes)
+
+        for index, v in enumerate(self):
+            if v == value:
+                return index
+
+        raise ValueError('{!r} is not in deque'.format(value))
+
+    def find(self, value):
+        """
+            The position of `value` itself, not just of a value equal to it, or None if it isn't in the deque.  O(1)
+            when it isn't, O(log n) when it is.
+        """
+        nodes = self._nodes.get(id(value))
+        return min(self._rank(node) for node in nodes) if nodes else None
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def count(self, value):
+        nodes = self._nodes.get(id(value))
+        return len(nodes) if nodes else sum(1 for v in self if v == value)
+
+    def clear(self):
+        self._nodes.clear()
+        self.counts.clear()
+        self._set_root(None)
+
+    def rotate(self, n=1):
+        size = len(self)
+        if not size or not n % size:
+            return
+
+        first, rest = _split(self._root, size - n % size)
+        self._set_root(_merge(rest, first))
+
+    def reverse(self):
+        self.replace(list(self)[::-1])
+
+    def replace(self, iterable):
+        """
+            Swaps the contents for the values of `iterable`, in O(n).  Reordering, filtering or shuffling a copy and
+            putting it back this way beats doing it a value at a time, which costs O(n log n).
+        """
+        values = list(iterable)
+        self.clear()
+        self.extend(values)
+
+    def bisect(self, key, sort_key):
+        """
+            The position `key` would go at among values in `sort_key` order, after any that are equal to it.  Only
+            meaningful while the values are in that order.
+        """
+        node, index = self._root, 0
+
+        while node:
+            if key < sort_key(node.value):
+                node = node.left
+            else:
+                index += _size(node.left) + 1
+                node = node.right
+
+        return index
+
+    def move(self, index, to):
+        """
+            Moves the value at `index` so that it ends up at position `to`, in O(log n).
+        """
+        index = self._index(index)
+        self.move_range(index, index + 1, to)
+
+    def move_range(self, start, stop, to):
+        """
+            Moves the values from `start` up to `stop` so that they start at position `to`, in O(log n).
+        """
+        size = len(self)
+        start, stop = max(0, min(start, size)), max(0, min(stop, size))
+        if start >= stop:
+            return
+
+        first, rest = _split(self._root, start)
+        moved, rest = _split(rest, stop - start)
+        rest = _merge(first, rest)
+
+        first, rest = _split(rest, max(0, min(to, _size(rest))))
+        self._set_root(_merge(_merge(first, moved), rest))
+
+    # Weights
+
+    @property
+    def total_weight(self):
+        return _total(self._root)
+
+    def weight_before(self, index):
+        """
+            The total weight of the first `index` values, in O(log n).
+        """
+        index = max(0, min(index, len(self)))
+        node, total = self._root, 0
+
+        while node and index:
+            left = _size(node.left)
+            if index <= left:
+                node = node.left
+            else:
+                total += _total(node.left) + node.weight
+                index -= left + 1
+                node = node.right
+
+        return total
+
+    def accumulate(self):
+        """
+            Yields each value along with the total weight of the values in front of it.
+        """
+        total = 0
+        for node in self._iter_nodes():
+            yield node.value, total
+            total += node.weight
+
+    def refresh(self, value):
+        """
+            Picks up a change to the weight of `value`, if it's in the deque.
+        """
+        for node in self._nodes.get(id(value), ()):
+            self._reweigh(node)
+
+
+def benchmark(sizes=(10000, 100000)):
+    """
+        Times shuffling, reversing, sorting and deduplicating queues of `sizes`, done in bulk with `replace` and done
+        in place on a plain deque the way they used to be.
+    """
+    import time
+    import random
+    from collections import deque
+
+    def timed(fn, *args):
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
+
+    def bulk(values, transform):
+        values.replace(transform(list(values)))
+
+    def dedupe(values):
+        seen = set()
+        return [v for v in values if not (v in seen or seen.add(v))]
+
+    results = []
+
+    for size in sizes:
+        values = [random.randrange(size // 2) for _ in range(size)]
+        indexed = IndexedDeque(values, weight=float)
+
+        results.append((size, {
+            'shuffle': timed(bulk, indexed, lambda v: random.sample(v, len(v))),
+            'reverse': timed(indexed.reverse),
+            'sort': timed(bulk, indexed, sorted),
+            'dedupe': timed(bulk, indexed, dedupe),
+            'deque shuffle': timed(random.shuffle, deque(values)),
+            'item by item shuffle': timed(random.shuffle, IndexedDeque(values, weight=float)),
+        }))
+
+    return results
+
+
+if __name__ == '__main__':
+    for size, timings in benchmark():
+        print('{} entries: {}'.format(size, ', '.join('{} {:.0f}ms'.format(name, t * 1000) for name, t in timings.items())))
@@ -0,0 +1,92 @@
+from bisect import bisect_left
+from threading import RLock
+from collections import deque
+
+
+class RollingHistogram:
+    """
+        A histogram of the last `window` values added.  Values are counted into buckets with the given upper `bounds`
+        (plus one for anything above the last), kept up to date as values come and go, so adding is O(log buckets)
+        and reading the summary never has to look at the raw values.
+
+        Values can be added from one thread, e.g. the voice thread, and read from another.
+    """
+
+    def __init__(self, bounds, window=1000):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.added = 0
+
+        self._values = deque(maxlen=window)
+        self._buckets = deque(maxlen=window)
+        self._lock = RLock()
+
+    def add(self, value):
+        bucket = bisect_left(self.bounds, value)
+
+        with self._lock:
+            if len(self._values) == self._values.maxlen:
+                self.counts[self._buckets[0]] -= 1
+                self.total -= self._values[0]
+
+            self._values.append(value)
+            self._buckets.append(bucket)
+            self.counts[bucket] += 1
+            self.total += value
+            self.added += 1
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._buckets.clear()
+            self.counts = [0] * (len(self.bounds) + 1)
+            self.total = 0.0
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def mean(self):
+        with self._lock:
+            return self.total / len(self._values) if self._values else 0.0
+
+    @property
+    def max(self):
+        with self._lock:
+            return max(self._values) if self._values else 0.0
+
+    def count_over(self, bound):
+        """
+            How many values in the window are over `bound`, which has to be one of the bucket bounds.
+        """
+        with self._lock:
+            return sum(self.counts[self.bounds.index(bound) + 1:])
+
+    def percentile(self, p):
+        """
+            The upper bound of the bucket the `p`th percentile falls in, capped at the largest value in the window.
+        """
+        with self._lock:
+            if not self._values:
+                return 0.0
+
+            target = p / 100 * len(self._values)
+            seen = 0
+
+            for bound, count in zip(self.bounds, self.counts):
+                seen += count
+                if seen >= target:
+                    return min(bound, self.max)
+
+            return self.max
+
+    def summary(self):
+        with self._lock:
+            return {
+                'count': len(self),
+                'mean': self.mean,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max
+            }
@@ -0,0 +1,41 @@
+import struct
+
+# capture pattern, version, header type, granule position, serial, page sequence, checksum, segment count
+_PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+
+
+def iter_packets(fp):
+    """
+        Yields the packets of the Ogg stream read from `fp`, joining packets that are split across pages.
+        Nothing is decoded or checksummed, this only undoes the Ogg framing.
+    """
+    partial = b''
+
+    while True:
+        header = fp.read(_PAGE_HEADER.size)
+        if not header:
+            break
+
+        if len(header) < _PAGE_HEADER.size:
+            raise ValueError('Truncated Ogg page header')
+
+        capture, version, header_type, granule, serial, sequence, checksum, segments = _PAGE_HEADER.unpack(header)
+        if capture != b'OggS':
+            raise ValueError('Bad Ogg capture pattern {!r}'.format(capture))
+
+        lacing = fp.read(segments)
+        body = fp.read(sum(lacing))
+        if len(lacing) < segments or len(body) < sum(lacing):
+            raise ValueError('Truncated Ogg page')
+
+        start = end = 0
+        for size in lacing:
+            end += size
+
+            # A lacing value under 255 ends the packet, 255 means it carries on in the next segment
+            if size < 255:
+                yield partial + body[start:end]
+                partial = b''
+                start = end
+
+        partial += body[start:end]
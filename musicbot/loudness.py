@@ -0,0 +1,173 @@
+import re
+import json
+import math
+import asyncio
+import logging
+import subprocess
+
+from .utils import md5sum
+
+log = logging.getLogger(__name__)
+
+# EBU R128 targets for the two-pass loudnorm mode
+LOUDNORM_TARGET = {'I': -16.0, 'TP': -1.5, 'LRA': 11.0}
+
+
+def _run_ffmpeg_filter(filename, audio_filter):
+    """
+        Runs `audio_filter` over the whole of `filename`, discarding the output, and returns what ffmpeg logged.
+    """
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-i', filename, '-vn', '-af', audio_filter, '-f', 'null', '-']
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    if result.returncode:
+        raise RuntimeError('ffmpeg exited with {}'.format(result.returncode))
+
+    return result.stderr.decode('utf8', 'replace')
+
+
+def measure_volume(filename):
+    """
+        Measures the mean and peak volume of `filename` with ffmpeg's volumedetect filter.
+    """
+    output = _run_ffmpeg_filter(filename, 'volumedetect')
+
+    mean_volume = re.findall(r"mean_volume: ([\-\d\.]+) dB", output)
+    max_volume = re.findall(r"max_volume: ([\-\d\.]+) dB", output)
+
+    return {
+        'mean_volume': float(mean_volume[0]) if mean_volume else 0.0,
+        'max_volume': float(max_volume[0]) if max_volume else 0.0
+    }
+
+
+def measure_loudness(filename):
+    """
+        Runs the measuring pass of ffmpeg's loudnorm (EBU R128) filter over `filename`.
+    """
+    target = ':'.join('{}={}'.format(k, v) for k, v in LOUDNORM_TARGET.items())
+    output = _run_ffmpeg_filter(filename, 'loudnorm={}:print_format=json'.format(target))
+
+    # The measurements are the last json object in the log
+    blocks = re.findall(r'\{[^{}]*\}', output)
+    if not blocks:
+        raise RuntimeError('No loudnorm measurements in ffmpeg output')
+
+    data = json.loads(blocks[-1])
+    return {key: float(data[key]) for key in ('input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset')}
+
+
+class FileAnalyzer:
+    """
+        Runs a measurement over downloaded files in the background and keeps the results in an `AnalysisStore`, keyed
+        by the file's hash, so a file is only ever measured once.  Playback never waits for a measurement.
+
+        Subclasses give the `kind` of result they store and the `measurement` function that produces it, which has to
+        be a module level function so it can run in a process pool.
+    """
+
+    kind = None
+    failure_message = "Couldn't analyse {}: {}"
+
+    def __init__(self, store, *, runner, loop=None):
+        self.store = store
+        self.runner = runner  # coroutine function that runs a blocking call off the event loop
+        self.loop = loop or asyncio.get_event_loop()
+
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.analysed = 0
+
+    @property
+    def measurement(self):
+        raise NotImplementedError
+
+    def result_for(self, filename):
+        """
+            Returns the stored result for `filename`, or None if it hasn't been measured yet.
+        """
+        result = self.store.get(filename, self.kind)
+
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return result
+
+    def request(self, filename):
+        """
+            Schedules a measurement of `filename`, unless it has one already.
+        """
+        if filename in self._pending or self.store.get(filename, self.kind) is not None:
+            return
+
+        self._pending[filename] = asyncio.ensure_future(self._analyse(filename), loop=self.loop)
+
+    async def _analyse(self, filename):
+        try:
+            fhash = self.store.hash_for(filename)
+            if fhash is None:
+                fhash = await self.runner(md5sum, filename)
+                self.store.set_hash(filename, fhash)
+
+            if self.store.get_by_hash(fhash, self.kind) is None:
+                log.debug("Running {} analysis of {}".format(self.kind, filename))
+
+                self.store.put(fhash, self.kind, await self.runner(self.measurement, filename))
+                self.analysed += 1
+
+        except Exception as e:
+            log.warning(self.failure_message.format(filename, e))
+
+        finally:
+            self._pending.pop(filename, None)
+            self.store.save_soon(self.loop)
+
+
+class LoudnessAnalyzer(FileAnalyzer):
+    """
+        Measures the loudness of downloaded files and turns those measurements into ffmpeg options.  A file that
+        hasn't been measured yet just plays without equalization.
+
+        In 'peak' mode the volume is raised until the loudest sample hits 0dB, like the old equalization did.
+        In 'ebur128' mode the stored measurements drive loudnorm's second, linear pass.
+    """
+
+    modes = ('peak', 'ebur128')
+    failure_message = "Couldn't measure the loudness of {}, it will play without equalization: {}"
+
+    def __init__(self, store, *, runner, mode='peak', loop=None):
+        super().__init__(store, runner=runner, loop=loop)
+        self.mode = mode if mode in self.modes else 'peak'
+
+    @property
+    def kind(self):
+        return self.mode
+
+    @property
+    def measurement(self):
+        return measure_loudness if self.mode == 'ebur128' else measure_volume
+
+    def options_for(self, filename):
+        """
+            Returns the ffmpeg output options that equalize `filename`, or None if it hasn't been measured yet.
+        """
+        result = self.result_for(filename)
+        if result is None:
+            return None
+
+        if self.mode == 'ebur128':
+            if not all(math.isfinite(v) for v in result.values()):
+                return None  # silence
+
+            return '-af "loudnorm={}:measured_I={input_i}:measured_TP={input_tp}:measured_LRA={input_lra}:' \
+                   'measured_thresh={input_thresh}:offset={target_offset}:linear=true"'.format(
+                ':'.join('{}={}'.format(k, v) for k, v in LOUDNORM_TARGET.items()), **result)
+
+        return '-af "volume={}dB"'.format(-result['max_volume'])
+
+    def __str__(self):
+        return '{} plays equalized, {} not ready\n{} files measured ({})'.format(self.hits, self.misses, self.analysed, self.mode)
@@ -23,10 +23,12 @@ class PermissionsDefaults:
     MaxSongLength = 210
     MaxPlaylistLength = 0
     MaxSearchItems = 10
+    QueueShare = 1.0
 
     AllowPlaylists = True
     InstaSkip = False
     Remove = False
+    Prefetch = False
     SkipWhenAbsent = True
     BypassKaraokeMode = False
 
@@ -43,10 +45,12 @@ class Permissive:
     MaxSongLength = 0
     MaxPlaylistLength = 0
     MaxSearchItems = 10
+    QueueShare = 1.0
 
     AllowPlaylists = True
     InstaSkip = True
     Remove = True
+    Prefetch = True
     SkipWhenAbsent = False
     BypassKaraokeMode = True
 
@@ -144,10 +148,12 @@ class PermissionGroup:
         self.max_song_length = section_data.get('MaxSongLength', fallback=fallback.MaxSongLength)
         self.max_playlist_length = section_data.get('MaxPlaylistLength', fallback=fallback.MaxPlaylistLength)
         self.max_search_items = section_data.get('MaxSearchItems', fallback=fallback.MaxSearchItems)
+        self.queue_share = section_data.get('QueueShare', fallback=fallback.QueueShare)
 
         self.allow_playlists = section_data.getboolean('AllowPlaylists', fallback=fallback.AllowPlaylists)
         self.instaskip = section_data.getboolean('InstaSkip', fallback=fallback.InstaSkip)
         self.remove = section_data.getboolean('Remove', fallback=fallback.Remove)
+        self.prefetch = section_data.getboolean('Prefetch', fallback=fallback.Prefetch)
         self.skip_when_absent = section_data.getboolean('SkipWhenAbsent', fallback=fallback.SkipWhenAbsent)
         self.bypass_karaoke_mode = section_data.getboolean('BypassKaraokeMode', fallback=fallback.BypassKaraokeMode)
 
@@ -194,6 +200,13 @@ class PermissionGroup:
         except:
             self.max_search_items = PermissionsDefaults.MaxSearchItems
 
+        try:
+            self.queue_share = float(self.queue_share)
+            if self.queue_share <= 0:
+                raise ValueError
+        except:
+            self.queue_share = PermissionsDefaults.QueueShare
+
         if int(self.max_search_items) > 100:
             log.warning('Max search items can\'t be larger than 100. Setting to 100.')
             self.max_search_items = 100
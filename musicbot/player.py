@@ -1,22 +1,26 @@
 import os
 import sys
 import json
+import time
 import logging
 import asyncio
 import audioop
 import subprocess
 import re
 
-from discord import FFmpegPCMAudio, PCMVolumeTransformer, AudioSource
+from discord import FFmpegPCMAudio, AudioSource
+from discord.opus import Encoder
 
 from enum import Enum
-from array import array
-from threading import Thread
-from collections import deque
-from shutil import get_terminal_size
+from threading import Thread, Lock
+from collections import deque, Counter
 from websockets.exceptions import InvalidState
 
-from .utils import avg, _func_
+from .utils import _func_
+from .lib.ogg import iter_packets
+from .lib.metrics import RollingHistogram
+from .dsp import DSPSource
+from .broadcast import BroadcastSubscriber
 from .lib.event_emitter import EventEmitter
 from .constructs import Serializable, Serializer
 from .exceptions import FFmpegError, FFmpegWarning
@@ -25,90 +29,221 @@ from .entry import URLPlaylistEntry, StreamPlaylistEntry
 log = logging.getLogger(__name__)
 
 
-class PatchedBuff:
+PREPARE_LEAD = 5  # seconds before the end of a song to get the next one ready
+PRIME_FRAMES = 10  # frames to buffer from the next song while getting it ready
+
+FRAME_TIME = Encoder.FRAME_LENGTH / 1000
+LATE_FRAME = 30  # ms between two reads after which the second missed its slot
+
+# Histogram buckets, in milliseconds
+READ_LATENCY_BOUNDS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 40)
+FRAME_INTERVAL_BOUNDS = (15, 19, 21, 25, LATE_FRAME, 40, 60, 100, 250)
+
+
+class MusicPlayerState(Enum):
+    STOPPED = 0  # When the player isn't playing anything
+    PLAYING = 1  # The player is actively playing music.
+    PAUSED = 2   # The player is paused on a song.
+    WAITING = 3  # The player has finished its song but is still downloading the next one
+    DEAD = 4     # The player has been killed.
+
+    def __str__(self):
+        return self.name
+
+class SourcePlaybackCounter(AudioSource):
+    def __init__(self, source, progress = 0, end = 0):
+        self._source = source
+        self.progress = progress
+        self.end = end  # seconds into the song where the source stops, 0 if unknown
+        self._primed = deque()
+
+    def prime(self, frames):
+        """
+            Reads the first `frames` frames ahead of time, so playback doesn't start by waiting on ffmpeg.
+        """
+        if isinstance(self._source, DSPSource):
+            # Buffer them ahead of the processing, so fades and volume still apply when they play
+            return self._source.prime(frames)
+
+        for _ in range(frames):
+            frame = self._source.read()
+            if not frame:
+                break
+            self._primed.append(frame)
+
+    def read(self):
+        res = self._primed.popleft() if self._primed else self._source.read()
+        if res:
+            self.progress += 1
+        return res
+
+    def get_progress(self):
+        return self.progress * FRAME_TIME
+
+    def is_opus(self):
+        return self._source.is_opus()
+
+    def cleanup(self):
+        self._source.cleanup()
+
+
+class GaplessSource(AudioSource):
     """
-        PatchedBuff monkey patches a readable object, allowing you to vary what the volume is as the song is playing.
+        What the voice client plays.  It reads from the current song's source, and when that runs out carries straight
+        on with the next song's source if the player has one ready, so the voice client never stops between songs.
+        With a crossfade set the two overlap for that long, the first fading out as the second fades in.
     """
 
-    def __init__(self, buff, *, draw=False):
-        self.buff = buff
-        self.frame_count = 0
-        self.volume = 1.0
+    def __init__(self, player, entry, source):
+        self.player = player
+        self.entry = entry
+        self.source = source
+        self._next = None  # (entry, source) to carry on with
+        self._mixing = False
 
-        self.draw = draw
-        self.use_audioop = True
-        self.frame_skip = 2
-        self.rmss = deque([2048], maxlen=90)
+        # The voice thread moves on to `_next` while the event loop queues and takes it back
+        self._lock = Lock()
 
-    def __del__(self):
-        if self.draw:
-            print(' ' * (get_terminal_size().columns-1), end='\r')
+    @property
+    def has_next(self):
+        return self._next is not None
 
-    def read(self, frame_size):
-        self.frame_count += 1
+    def queue(self, entry, source):
+        with self._lock:
+            self._next = (entry, source)
 
-        frame = self.buff.read(frame_size)
+    def unqueue(self):
+        """
+            Takes back the queued (entry, source), or returns None if there isn't one.
+        """
+        with self._lock:
+            return self._unqueue()
 
-        if self.volume != 1:
-            frame = self._frame_vol(frame, self.volume, maxv=2)
+    def unqueue_unless(self, entry):
+        """
+            Takes back the queued (entry, source) if it isn't for `entry`, unless it's already being crossfaded into.
+        """
+        with self._lock:
+            queued = self._next
+            if queued is None or queued[0] is entry or self._mixing:
+                return None
 
-        if self.draw and not self.frame_count % self.frame_skip:
-            # these should be processed for every frame, but "overhead"
-            rms = audioop.rms(frame, 2)
-            self.rmss.append(rms)
+            return self._unqueue()
 
-            max_rms = sorted(self.rmss)[-1]
-            meter_text = 'avg rms: {:.2f}, max rms: {:.2f} '.format(avg(self.rmss), max_rms)
-            self._pprint_meter(rms / max(1, max_rms), text=meter_text, shift=True)
+    def _unqueue(self):
+        queued, self._next = self._next, None
+        self._mixing = False
+        return queued
 
+    def read(self):
+        started = time.perf_counter()
+        frame = self._read()
+        self.player._record_frame(started, time.perf_counter(), frame)
         return frame
 
-    def _frame_vol(self, frame, mult, *, maxv=2, use_audioop=True):
-        if use_audioop:
-            return audioop.mul(frame, 2, min(mult, maxv))
-        else:
-            # ffmpeg returns s16le pcm frames.
-            frame_array = array('h', frame)
+    def _read(self):
+        frame = self.source.read()
 
-            for i in range(len(frame_array)):
-                frame_array[i] = int(frame_array[i] * min(mult, min(1, maxv)))
+        if self._next and not self._mixing and self.player.crossfade:
+            self._start_crossfade()
 
-            return frame_array.tobytes()
+        # Once mixing, the queued source can't be taken back, only advanced to
+        queued = self._next if self._mixing else None
+        if queued:
+            upcoming = queued[1].read()
+            if frame and upcoming:
+                return audioop.add(frame, upcoming, 2)
+            if upcoming:
+                return self._advance(upcoming)
 
-    def _pprint_meter(self, perc, *, char='#', text='', shift=True):
-        tx, ty = get_terminal_size()
+        if frame:
+            return frame
 
-        if shift:
-            outstr = text + "{}".format(char * (int((tx - len(text)) * perc) - 1))
-        else:
-            outstr = text + "{}".format(char * (int(tx * perc) - 1))[len(text):]
+        if self.source.end and self.source.get_progress() < self.source.end - 1:
+            # Ran dry before the song was over
+            self.player.underruns += 1
 
-        print(outstr.ljust(tx - 1), end='\r')
+        return self._advance()
 
+    def _start_crossfade(self):
+        with self._lock:
+            queued = self._next  # the player may have taken it back
+            if queued is None:
+                return
 
-class MusicPlayerState(Enum):
-    STOPPED = 0  # When the player isn't playing anything
-    PLAYING = 1  # The player is actively playing music.
-    PAUSED = 2   # The player is paused on a song.
-    WAITING = 3  # The player has finished its song but is still downloading the next one
-    DEAD = 4     # The player has been killed.
+            entry, source = queued
+            remaining = self.source.end - self.source.get_progress()
 
-    def __str__(self):
-        return self.name
+            # Opus frames can't be mixed, those just follow on
+            if not self.source.end or remaining > self.player.crossfade or self.source.is_opus() or source.is_opus():
+                return
 
-class SourcePlaybackCounter(AudioSource):
-    def __init__(self, source, progress = 0):
-        self._source = source
-        self.progress = progress
+            self.source._source.fade_out(remaining)
+            source._source.fade_in(remaining)
+            self._mixing = True
+
+    def _advance(self, frame=None):
+        started = time.perf_counter()
+
+        with self._lock:
+            # Taken and swapped in one go, so the player can't take back a source that's already playing
+            queued = self._unqueue()
+            if queued is None:
+                return b''
+
+            old_entry, old_source = self.entry, self.source
+            self.entry, self.source = queued
+
+        self.player.loop.call_soon_threadsafe(self.player._advanced, old_entry, old_source, self.entry, self.source)
+
+        frame = frame or self.source.read()
+        self.player._record_gap(time.perf_counter() - started, gapless=True)
+        return frame
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        # Whatever is queued up next is the player's to reuse or clean up
+        self.source.cleanup()
+
+
+class OpusFileSource(AudioSource):
+    """
+        Plays an Ogg Opus file from the opus cache by handing its 20ms packets to discord as they are.
+    """
+
+    def __init__(self, filename, skip=0, limit=None):
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._packets = iter_packets(self._file)
+        self._left = limit  # packets to play before stopping, None for all of them
+
+        # Skip the OpusHead and OpusTags header packets, then `skip` packets of audio to seek
+        for _ in range(2 + skip):
+            self._next_packet()
 
     def read(self):
-        res = self._source.read()
-        if res:
-            self.progress += 1
-        return res
+        if self._left is not None:
+            if self._left <= 0:
+                return b''
+            self._left -= 1
 
-    def get_progress(self):
-        return self.progress * 0.02
+        return self._next_packet()
+
+    def _next_packet(self):
+        try:
+            return next(self._packets, b'')
+        except ValueError as e:
+            # A damaged cache file ends the song early instead of taking the voice thread down with it
+            log.warning("Stopped playing {}: {}".format(self.filename, e))
+            return b''
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._file.close()
 
 
 class MusicPlayer(EventEmitter, Serializable):
@@ -124,6 +259,28 @@ class MusicPlayer(EventEmitter, Serializable):
         self.karaoke_mode = False
         self.songs_played = 0
 
+        # How often, and for how long, a song had to wait on its download
+        self.waits = 0
+        self.wait_time = 0.0
+        self.longest_wait = 0.0
+
+        self.ffmpeg_counts = Counter()
+
+        # Silence between the end of one song and the start of the next
+        self.gaps = deque(maxlen=100)
+        self.gapless = 0
+
+        self.crossfade = bot.config.crossfade
+
+        # Timing of the frames handed to the voice client, over the last minute
+        self.read_latency = RollingHistogram(READ_LATENCY_BOUNDS, window=3000)
+        self.frame_intervals = RollingHistogram(FRAME_INTERVAL_BOUNDS, window=3000)
+        self.frames_played = 0
+        self.slow_reads = 0  # frames that took longer than a frame's worth of time to read
+        self.underruns = 0  # songs that ran dry before their end
+        self.late_frames = 0
+        self._last_read = None
+
         self._volume = bot.config.default_volume
         self._play_lock = asyncio.Lock()
         self._current_player = None
@@ -131,8 +288,14 @@ class MusicPlayer(EventEmitter, Serializable):
         self._stderr_future = None
 
         self._source = None
+        self._output = None  # the GaplessSource the voice client is playing
+        self._prepared = None  # (entry, source) spawned ahead of time for the next song
+        self._prepare_handle = None
+        self._track_ended = None
+        self._resume_at = None  # (entry, seconds) to pick back up from after a restart
 
         self.playlist.on('entry-added', self.on_entry_added)
+        self.playlist.on('entries-changed', self.on_entries_changed)
 
     @property
     def volume(self):
@@ -141,15 +304,46 @@ class MusicPlayer(EventEmitter, Serializable):
     @volume.setter
     def volume(self, value):
         self._volume = value
-        if self._source:
+        if not self._source:
+            return
+
+        if self._source.is_opus():
+            # Opus cache files have their volume baked in, so carry on from the same spot through ffmpeg
+            self.loop.create_task(self._seek(self._current_entry, self.progress))
+        else:
             self._source._source.volume = value
 
     def on_entry_added(self, playlist, entry):
+        self._check_next(playlist)
+
         if self.is_stopped:
-            self.loop.call_later(2, self.play)
+            self.loop.call_soon(self.play)
+        elif self._current_entry:
+            # It might be next, or the current song may be close to ending with nothing lined up
+            self._schedule_next()
 
         self.emit('entry-added', player=self, playlist=playlist, entry=entry)
 
+    def on_entries_changed(self, playlist, added=(), **kwargs):
+        if self.is_dead:
+            return  # the queue is emptied on the way out, that's not a change worth passing on
+
+        self._check_next(playlist)
+
+        if added and self.is_stopped:
+            self.loop.call_soon(self.play)
+        elif self._current_entry:
+            self._schedule_next()
+
+        self.emit('entries-changed', player=self, playlist=playlist, added=added, **kwargs)
+
+    def _check_next(self, playlist):
+        if self._output:
+            # The song lined up to follow on might not be next anymore, hang on to it in case it comes up again
+            stale = self._output.unqueue_unless(playlist.peek())
+            if stale:
+                self._keep_prepared(stale)
+
     def skip(self):
         self._kill_current_player()
 
@@ -161,6 +355,7 @@ class MusicPlayer(EventEmitter, Serializable):
 
     def resume(self):
         if self.is_paused and self._current_player:
+            self._last_read = None
             self._current_player.resume()
             self.state = MusicPlayerState.PLAYING
             self.emit('resume', player=self, entry=self.current_entry)
@@ -193,10 +388,20 @@ class MusicPlayer(EventEmitter, Serializable):
         self.playlist.clear()
         self._events.clear()
         self._kill_current_player()
+        self._discard_prepared()
 
     def _playback_finished(self, error=None):
         entry = self._current_entry
 
+        if self._output:
+            # Keep the next song's source if it was ready, it'll be picked up when that song plays
+            prepared = self._output.unqueue()
+            if prepared:
+                self.loop.call_soon_threadsafe(self._keep_prepared, prepared)
+            self._output = None
+
+        self._track_ended = time.perf_counter() if self.playlist.entries else None
+
         if self._current_player:
             self._current_player.after = None
             self._kill_current_player()
@@ -209,31 +414,9 @@ class MusicPlayer(EventEmitter, Serializable):
             # unless ffmpeg is doing something highly questionable
             self.emit('error', player=self, entry=entry, ex=self._stderr_future.exception())
 
-        if not self.bot.config.save_videos and entry:
-            if not isinstance(entry, StreamPlaylistEntry):
-                if any([entry.filename == e.filename for e in self.playlist.entries]):
-                    log.debug("Skipping deletion of \"{}\", found song in queue".format(entry.filename))
-
-                else:
-                    log.debug("Deleting file: {}".format(os.path.relpath(entry.filename)))
-                    filename = entry.filename
-                    for x in range(30):
-                        try:
-                            os.unlink(filename)
-                            log.debug('File deleted: {0}'.format(filename))
-                            break
-                        except PermissionError as e:
-                            if e.winerror == 32:  # File is in use
-                                log.error('Can\'t delete file, it is currently in use: {0}').format(filename)
-                        except FileNotFoundError:
-                            log.debug('Could not find delete {} as it was not found. Skipping.'.format(filename), exc_info=True)
-                            break
-                        except Exception:
-                            log.error("Error trying to delete {}".format(filename), exc_info=True)
-                            break
-                    else:
-                        print("[Config:SaveVideos] Could not delete file {}, giving up and moving on".format(
-                            os.path.relpath(filename)))
+        if entry and not isinstance(entry, StreamPlaylistEntry):
+            # This runs on the voice thread, cleanup happens in the background on the event loop
+            self.loop.call_soon_threadsafe(self.bot.audio_cache.request_eviction)
 
         self.emit('finished-playing', player=self, entry=entry)
 
@@ -264,15 +447,34 @@ class MusicPlayer(EventEmitter, Serializable):
         if self.is_dead:
             return
 
-        with await self._play_lock:
+        async with self._play_lock:
+            if _continue and self._current_entry:
+                return  # already carried on to the next song without stopping
+
             if self.is_stopped or _continue:
+                next_entry = self.playlist.peek()
+                waiting = next_entry is not None and not next_entry.is_downloaded
+                prev_state = self.state
+
+                if waiting:
+                    self.state = MusicPlayerState.WAITING
+                    wait_start = time.monotonic()
+
                 try:
                     entry = await self.playlist.get_next_entry()
                 except:
                     log.warning("Failed to get entry, retrying", exc_info=True)
+                    # The entry that failed is already off the queue, so the retry moves on to the next one
+                    if not self.is_dead:
+                        self.state = MusicPlayerState.STOPPED
                     self.loop.call_later(0.1, self.play)
                     return
 
+                if waiting:
+                    if self.is_waiting:
+                        self.state = prev_state
+                    self._record_wait(time.monotonic() - wait_start)
+
                 # If nothing left to play, transition to the stopped state.
                 if not entry:
                     self.stop()
@@ -281,28 +483,23 @@ class MusicPlayer(EventEmitter, Serializable):
                 # In-case there was a player, kill it. RIP.
                 self._kill_current_player()
 
-                boptions = "-nostdin"
-                # aoptions = "-vn -b:a 192k"
-                if isinstance(entry, URLPlaylistEntry):
-                    aoptions = entry.aoptions
-                else:
-                    aoptions = "-vn"
-
-                log.ffmpeg("Creating player with options: {} {} {}".format(boptions, aoptions, entry.filename))
-
-                self._source = SourcePlaybackCounter(
-                    PCMVolumeTransformer(
-                        FFmpegPCMAudio(
-                            entry.filename,
-                            before_options=boptions,
-                            options=aoptions,
-                            stderr=subprocess.PIPE
-                        ),
-                        self.volume
-                    )
-                )
+                start = 0
+                if self._resume_at and self._resume_at[0] is entry:
+                    start = self._resume_at[1]
+                    log.info("Resuming {} from {:.1f}s".format(entry.title, start))
+                self._resume_at = None
+
+                self._source = not start and self._take_prepared(entry) or self._create_source(entry, start)
+                self._discard_prepared()
+                self._output = GaplessSource(self, entry, self._source)
+                self._last_read = None
+
                 log.debug('Playing {0} using {1}'.format(self._source, self.voice_client))
-                self.voice_client.play(self._source, after=self._playback_finished)
+                self.voice_client.play(self._output, after=self._playback_finished)
+
+                if self._track_ended:
+                    self._record_gap(time.perf_counter() - self._track_ended)
+                    self._track_ended = None
 
                 self._current_player = self.voice_client
 
@@ -310,25 +507,308 @@ class MusicPlayer(EventEmitter, Serializable):
                 self.state = MusicPlayerState.PLAYING
                 self._current_entry = entry
 
-                self._stderr_future = asyncio.Future()
-
-                stderr_thread = Thread(
-                    target=filter_stderr,
-                    args=(self._source._source.original._process, self._stderr_future),
-                    name="stderr reader"
-                )
-
-                stderr_thread.start()
+                self._watch_source()
+                self._schedule_next()
 
                 self.emit('play', player=self, entry=entry)
                 self.songs_played += 1
 
+    def _schedule_next(self):
+        """
+            Sets the next song to be spawned and primed a little before the current one ends.
+        """
+        if self._prepare_handle:
+            self._prepare_handle.cancel()
+            self._prepare_handle = None
+
+        entry = self._current_entry
+        if not self.bot.config.gapless_playback or not entry or not self._output or not self._source.end:
+            return
+
+        delay = self._source.end - self.progress - self._prepare_lead
+        self._prepare_handle = self.loop.call_later(max(0, delay), self._prepare_soon, entry)
+
+    @property
+    def _prepare_lead(self):
+        return max(PREPARE_LEAD, self.crossfade + 1)
+
+    def _prepare_soon(self, entry):
+        self._prepare_handle = None
+        self.loop.create_task(self._prepare_next(entry))
+
+    async def _prepare_next(self, current):
+        """
+            Spawns and primes the source for whatever is next in the queue, and queues it behind `current`.
+        """
+        upcoming = self.playlist.peek()
+        if upcoming is None or self._output is None or self._output.has_next:
+            return
+
+        if not upcoming.is_downloaded:
+            await asyncio.wait([upcoming.get_ready_future()], timeout=self._prepare_lead)
+            if not upcoming.is_downloaded:
+                return
+
+        async with self._play_lock:
+            if self._current_entry is not current or self.playlist.peek() is not upcoming or self._output.has_next:
+                return
+
+            try:
+                source = self._create_source(upcoming)
+                await self.loop.run_in_executor(None, source.prime, PRIME_FRAMES)
+            except Exception as e:
+                log.warning("Couldn't get {} ready ahead of time: {}".format(upcoming.title, e))
+                return
+
+            if self._output and self._current_entry is current and self.playlist.peek() is upcoming:
+                log.debug("Queued up {} to follow on from {}".format(upcoming.title, current.title))
+                self._output.queue(upcoming, source)
+            else:
+                source.cleanup()
+
+    def _advanced(self, old_entry, old_source, entry, source):
+        """
+            Catches up with the GaplessSource moving on to the next song.
+        """
+        old_source.cleanup()
+
+        self.playlist.take(entry)
+
+        if self._stderr_future.done() and self._stderr_future.exception():
+            self.emit('error', player=self, entry=old_entry, ex=self._stderr_future.exception())
+
+        if not isinstance(old_entry, StreamPlaylistEntry):
+            self.bot.audio_cache.request_eviction()
+
+        self._current_entry = entry
+        self._source = source
+        self._watch_source()
+
+        self.emit('finished-playing', player=self, entry=old_entry)
+
+        self.playlist.prefetch()
+        self.playlist.downloader.reprioritize(self.loop)
+        self._schedule_next()
+
+        self.emit('play', player=self, entry=entry)
+        self.songs_played += 1
+
+    def _keep_prepared(self, prepared):
+        self._discard_prepared()
+        self._prepared = prepared
+
+        if self.is_dead:
+            self._discard_prepared()
+
+    def _take_prepared(self, entry):
+        if self._prepared and self._prepared[0] is entry:
+            __, source = self._prepared
+            self._prepared = None
+            return source
+
+    def _discard_prepared(self):
+        if self._prepared:
+            self._prepared[1].cleanup()
+            self._prepared = None
+
+    def _create_source(self, entry, start=0):
+        """
+            Builds the audio source for `entry`, starting `start` seconds in.
+        """
+        boptions = "-nostdin"
+        # aoptions = "-vn -b:a 192k"
+        if isinstance(entry, URLPlaylistEntry):
+            aoptions = entry.aoptions
+        else:
+            aoptions = "-vn"
+
+        source_path = entry.filename
+        opus_path = None
+        end = entry.duration
+        trim_end = None
+
+        if isinstance(entry, URLPlaylistEntry):
+            if entry.is_downloaded:
+                self.bot.audio_cache.touch(entry.filename)
+
+                bounds = self.bot.silence.bounds_for(entry.filename) if self.bot.silence else None
+                if bounds:
+                    # Skip the silence at the start, and stop where the silence at the end begins
+                    start = max(start, bounds[0])
+                    if bounds[1] is not None:
+                        end = trim_end = bounds[1]
+
+                # Nothing to do to the audio, so it can come straight from the opus cache
+                if self.bot.opus_cache and aoptions == '-vn':
+                    opus_path = self.bot.opus_cache.get(entry.filename, self.volume)
+            else:
+                # Progressive playback, the download is still running
+                source_path = entry.stream_url
+                boptions += ' ' + entry.stream_options
+
+        # Counted in 20ms frames, like the progress
+        start_frames = int(start / 0.02)
+        length_frames = max(1, int(trim_end / 0.02) - start_frames) if trim_end else None
+
+        if opus_path:
+            try:
+                source = SourcePlaybackCounter(OpusFileSource(opus_path, start_frames, length_frames), start_frames, end)
+                log.debug("Playing {} from the opus cache".format(opus_path))
+                return source
+            except OSError as e:
+                log.warning("Can't open opus cache file {}, falling back to ffmpeg ({})".format(opus_path, e))
+                self.bot.opus_cache.forget(entry.filename)
+
+        if start_frames:
+            # Input seeking, ffmpeg jumps straight to the nearest keyframe instead of decoding up to it
+            boptions += ' -ss {:.2f}'.format(start_frames * 0.02)
+
+        if length_frames:
+            boptions += ' -t {:.2f}'.format(length_frames * 0.02)
+
+        def ffmpeg():
+            log.ffmpeg("Creating player with options: {} {} {}".format(boptions, aoptions, source_path))
+            if self.bot.ffmpeg_pool:
+                return self.bot.ffmpeg_pool.create(source_path, boptions, aoptions)
+            return FFmpegPCMAudio(source_path, before_options=boptions, options=aoptions, stderr=subprocess.PIPE)
+
+        if self.bot.broadcasts and isinstance(entry, StreamPlaylistEntry):
+            # Every server playing this stream shares the one ffmpeg process
+            audio = self.bot.broadcasts.subscribe((entry.url, aoptions), ffmpeg)
+        else:
+            audio = ffmpeg()
+
+        return SourcePlaybackCounter(DSPSource(audio, self.volume), start_frames, end)
+
+    def _watch_source(self):
+        if self._source.is_opus():
+            # No ffmpeg involved
+            self._stderr_future = asyncio.Future()
+            self._stderr_future.set_result(True)
+
+        elif isinstance(self._source._source.original, BroadcastSubscriber):
+            # The broadcast watches its own ffmpeg
+            self._stderr_future = self._source._source.original.broadcast.stderr_future
+
+        else:
+            self._stderr_future = asyncio.Future()
+            self.bot.stderr_monitor.watch(self._source._source.original._process, self._stderr_future, self.ffmpeg_counts)
+
+    async def seek(self, position):
+        """
+            Moves playback of the current entry to `position` seconds in.
+        """
+        entry = self.current_entry
+
+        if not entry or not self._current_player or isinstance(entry, StreamPlaylistEntry):
+            raise ValueError('Cannot seek, nothing seekable is playing')
+
+        end = self._source.end if self._source else entry.duration
+        if end and position >= end:
+            raise ValueError('Cannot seek past the end of the song')
+
+        await self._seek(entry, max(0, position))
+
+    async def _seek(self, entry, position):
+        async with self._play_lock:
+            if entry is not self._current_entry or not self._output:
+                return  # the song ended while we waited for the lock
+
+            old_source = self._source
+            self._source = self._create_source(entry, position)
+
+            if not self._source.is_opus():
+                # Saves a click at the jump
+                self._source._source.fade_in(0.1)
+
+            self._output.source = self._source
+            self._watch_source()
+            self._schedule_next()
+
+            # The voice thread may still be in the middle of a read from the old source
+            self.loop.call_later(1, old_source.cleanup)
+
+            log.debug("Seeked {} to {:.1f}s".format(entry.title, position))
+            self.emit('seek', player=self, entry=entry, position=position)
+
+    def _record_frame(self, started, finished, frame):
+        # Runs on the voice thread for every frame, so keep it cheap
+        if not frame:
+            self._last_read = None
+            return
+
+        self.frames_played += 1
+
+        latency = finished - started
+        self.read_latency.add(latency * 1000)
+        if latency > FRAME_TIME:
+            self.slow_reads += 1  # the source couldn't keep up
+
+        if self._last_read is not None:
+            interval = (started - self._last_read) * 1000
+            self.frame_intervals.add(interval)
+            if interval > LATE_FRAME:
+                self.late_frames += 1
+
+        self._last_read = started
+
+    def get_playback_stats(self):
+        """
+            Where playback is and how smoothly it's going.  Latencies and intervals are in milliseconds, and cover
+            the last minute of frames.  `late_ratio` is the share of those frames that missed their slot.
+            `slow_reads` counts frames the source took too long to produce, `underruns` songs that ran out early.
+        """
+        intervals = len(self.frame_intervals)
+
+        return {
+            'progress': self.progress or 0.0,
+            'frames': self._source.progress if self._source else 0,
+            'frames_played': self.frames_played,
+            'read_latency': self.read_latency.summary(),
+            'frame_interval': self.frame_intervals.summary(),
+            'slow_reads': self.slow_reads,
+            'underruns': self.underruns,
+            'late_frames': self.late_frames,
+            'late_ratio': self.frame_intervals.count_over(LATE_FRAME) / intervals if intervals else 0.0
+        }
+
+    def _record_gap(self, duration, *, gapless=False):
+        self.gaps.append(duration)
+        if gapless:
+            self.gapless += 1
+
+    @property
+    def gap_stats(self):
+        """
+            A summary of the silence between songs.
+        """
+        gaps = list(self.gaps)
+        if not gaps:
+            return 'No songs changed yet'
+
+        return '{} of the last {} gapless\n{:.0f}ms avg, {:.0f}ms max'.format(
+            min(self.gapless, len(gaps)), len(gaps), sum(gaps) / len(gaps) * 1000, max(gaps) * 1000)
+
+    def _record_wait(self, duration):
+        self.waits += 1
+        self.wait_time += duration
+        self.longest_wait = max(self.longest_wait, duration)
+        log.debug("Waited {:.2f}s for the next entry to download".format(duration))
+
+    @property
+    def wait_stats(self):
+        """
+            A summary of how often playback had to wait on a download.
+        """
+        return '{} of {} songs waited\n{:.1f}s avg, {:.1f}s max'.format(
+            self.waits, self.songs_played, self.wait_time / self.waits if self.waits else 0, self.longest_wait)
+
     def __json__(self):
         return self._enclose_json({
             'current_entry': {
                 'entry': self.current_entry,
                 'progress': self.progress,
-                'progress_frames': self._current_player._player.loops if self.progress is not None else None
+                'progress_frames': self._source.progress if self._source else None
             },
             'entries': self.playlist
         })
@@ -347,11 +827,12 @@ class MusicPlayer(EventEmitter, Serializable):
 
         current_entry_data = data['current_entry']
         if current_entry_data['entry']:
-            player.playlist.entries.appendleft(current_entry_data['entry'])
-            # TODO: progress stuff
-            # how do I even do this
-            # this would have to be in the entry class right?
-            # some sort of progress indicator to skip ahead with ffmpeg (however that works, reading and ignoring frames?)
+            entry = current_entry_data['entry']
+            player.playlist.entries.appendleft(entry)
+
+            # Live streams can't be seeked, they just start from wherever they are now
+            if current_entry_data.get('progress') and not isinstance(entry, StreamPlaylistEntry):
+                player._resume_at = (entry, current_entry_data['progress'])
 
         return player
 
@@ -379,46 +860,141 @@ class MusicPlayer(EventEmitter, Serializable):
     def is_stopped(self):
         return self.state == MusicPlayerState.STOPPED
 
+    @property
+    def is_waiting(self):
+        return self.state == MusicPlayerState.WAITING
+
     @property
     def is_dead(self):
         return self.state == MusicPlayerState.DEAD
 
     @property
     def progress(self):
+        """
+            Seconds into the current song, counted in frames handed to the voice client, so pauses don't count.
+        """
         if self._source:
             return self._source.get_progress()
-            # TODO: Properly implement this
-            #       Correct calculation should be bytes_read/192k
-            #       192k AKA sampleRate * (bitDepth / 8) * channelCount
-            #       Change frame_count to bytes_read in the PatchedBuff
 
-# TODO: I need to add a check for if the eventloop is closed
+_FFMPEG_WARNINGS = re.compile('|'.join(re.escape(msg) for msg in (
+    "Header missing",
+    "Estimating duration from birate, this may be inaccurate",
+    "Using AVStream.codec to pass codec parameters to muxers is deprecated, use AVStream.codecpar instead.",
+    "Application provided invalid, non monotonically increasing dts to muxer in stream",
+    "Last message repeated",
+    "Failed to send close message",
+    "decode_band_types: Input buffer exhausted before END element found"
+)))
 
-def filter_stderr(popen:subprocess.Popen, future:asyncio.Future):
-    last_ex = None
+_FFMPEG_ERRORS = re.compile('|'.join(re.escape(msg) for msg in (
+    "Invalid data found when processing input",  # need to regex this properly, its both a warning and an error
+)))
 
-    while True:
-        data = popen.stderr.readline()
-        if data:
-            log.ffmpeg("Data from ffmpeg: {}".format(data))
-            try:
-                if check_stderr(data):
-                    sys.stderr.buffer.write(data)
-                    sys.stderr.buffer.flush()
 
-            except FFmpegError as e:
-                log.ffmpeg("Error from ffmpeg: %s", str(e).strip())
-                last_ex = e
+class StderrMonitor:
+    """
+        Reads the stderr of every ffmpeg process the players start from the event loop, rather than with a thread
+        per song.  Event loops that can't read pipes (the selector loop on windows) get a thread per process instead.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.watching = 0
+        self._use_threads = False
 
-            except FFmpegWarning:
-                pass # useless message
+    def watch(self, popen, future, counts):
+        """
+            Watches `popen` until its stderr closes, then resolves `future` with True, or with the last error
+            ffmpeg reported.  Warnings and errors are tallied in the `counts` Counter.
+        """
+        watch = _StderrWatch(self, future, counts)
+        self.watching += 1
+
+        if self._use_threads:
+            self._watch_in_thread(popen, watch)
+        else:
+            asyncio.ensure_future(self._connect(popen, watch), loop=self.loop)
+
+    async def _connect(self, popen, watch):
+        try:
+            await self.loop.connect_read_pipe(lambda: _StderrProtocol(watch), popen.stderr)
+        except (NotImplementedError, OSError, ValueError) as e:
+            # Windows selector and proactor loops can't always read a subprocess pipe, threads always can
+            log.debug("Event loop can't read pipes ({}), watching ffmpeg with threads instead".format(e or type(e).__name__))
+            self._use_threads = True
+            self._watch_in_thread(popen, watch)
+        except Exception as e:
+            log.warning("Couldn't watch ffmpeg's stderr: {}".format(e))
+            watch.finish()
+
+    def _watch_in_thread(self, popen, watch):
+        def read():
+            for line in iter(popen.stderr.readline, b''):
+                self.loop.call_soon_threadsafe(watch.feed, line)
+            self.loop.call_soon_threadsafe(watch.finish)
+
+        Thread(target=read, name="stderr reader", daemon=True).start()
+
+
+class _StderrWatch:
+    def __init__(self, monitor, future, counts):
+        self.monitor = monitor
+        self.future = future
+        self.counts = counts
+        self.last_ex = None
+
+    def feed(self, data):
+        log.ffmpeg("Data from ffmpeg: {}".format(data))
+        try:
+            if check_stderr(data):
+                sys.stderr.buffer.write(data)
+                sys.stderr.buffer.flush()
+
+        except FFmpegError as e:
+            log.ffmpeg("Error from ffmpeg: %s", str(e).strip())
+            self.counts['errors'] += 1
+            self.last_ex = e
+
+        except FFmpegWarning:
+            self.counts['warnings'] += 1  # useless message
+
+    def finish(self):
+        if self.future.done():
+            return
+
+        self.monitor.watching -= 1
+
+        if self.last_ex:
+            self.future.set_exception(self.last_ex)
         else:
-            break
+            self.future.set_result(True)
+
+
+class _StderrProtocol(asyncio.Protocol):
+    max_line = 64 * 1024
+
+    def __init__(self, watch):
+        self.watch = watch
+        self.buffer = b''
+
+    def data_received(self, data):
+        *lines, self.buffer = (self.buffer + data).split(b'\n')
+
+        for line in lines:
+            self.watch.feed(line + b'\n')
+
+        if len(self.buffer) > self.max_line:
+            self.watch.feed(self.buffer)
+            self.buffer = b''
+
+    def eof_received(self):
+        if self.buffer:
+            self.watch.feed(self.buffer)
+            self.buffer = b''
+
+    def connection_lost(self, exc):
+        self.watch.finish()
 
-    if last_ex:
-        future.set_exception(last_ex)
-    else:
-        future.set_result(True)
 
 def check_stderr(data:bytes):
     try:
@@ -427,26 +1003,10 @@ def check_stderr(data:bytes):
         log.ffmpeg("Unknown error decoding message from ffmpeg", exc_info=True)
         return True # fuck it
 
-    # log.ffmpeg("Decoded data from ffmpeg: {}".format(data))
-
-    # TODO: Regex
-    warnings = [
-        "Header missing",
-        "Estimating duration from birate, this may be inaccurate",
-        "Using AVStream.codec to pass codec parameters to muxers is deprecated, use AVStream.codecpar instead.",
-        "Application provided invalid, non monotonically increasing dts to muxer in stream",
-        "Last message repeated",
-        "Failed to send close message",
-        "decode_band_types: Input buffer exhausted before END element found"
-    ]
-    errors = [
-        "Invalid data found when processing input", # need to regex this properly, its both a warning and an error
-    ]
-
-    if any(msg in data for msg in warnings):
+    if _FFMPEG_WARNINGS.search(data):
         raise FFmpegWarning(data)
 
-    if any(msg in data for msg in errors):
+    if _FFMPEG_ERRORS.search(data):
         raise FFmpegError(data)
 
     return True
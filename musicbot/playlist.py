@@ -1,10 +1,13 @@
 import os.path
+import asyncio
+import functools
 import logging
 import datetime
+import weakref
 
 from random import shuffle
 from itertools import islice
-from collections import deque
+from contextlib import contextmanager
 
 from urllib.error import URLError
 from youtube_dl.utils import ExtractorError, DownloadError, UnsupportedError
@@ -12,11 +15,47 @@ from youtube_dl.utils import ExtractorError, DownloadError, UnsupportedError
 from .utils import get_header
 from .constructs import Serializable
 from .lib.event_emitter import EventEmitter
-from .entry import URLPlaylistEntry, StreamPlaylistEntry
+from .lib.indexed_deque import IndexedDeque
+from .entry import URLPlaylistEntry, LazyURLPlaylistEntry, StreamPlaylistEntry
 from .exceptions import ExtractionError, WrongEntryTypeError
+from .permissions import PermissionsDefaults
 
 log = logging.getLogger(__name__)
 
+# How long a progressive play waits on the download before streaming instead, enough for cache hits
+PROGRESSIVE_GRACE = 0.5
+
+
+def _entry_author(entry):
+    return entry.meta.get('author', None)
+
+
+def _entry_duration(entry):
+    return entry.duration or 0
+
+
+def _author_sort_key(entry):
+    author = _entry_author(entry)
+    return (author is None, getattr(author, 'name', '').lower())
+
+
+SORT_KEYS = {
+    'duration': _entry_duration,
+    'author': _author_sort_key,
+    'title': lambda entry: entry.title.lower()
+}
+
+
+class _Batch:
+    """
+        The changes made during a `Playlist.batch`.
+    """
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = False
+
 
 class Playlist(EventEmitter, Serializable):
     """
@@ -28,7 +67,19 @@ class Playlist(EventEmitter, Serializable):
         self.bot = bot
         self.loop = bot.loop
         self.downloader = bot.downloader
-        self.entries = deque()
+        self.entries = IndexedDeque(key=_entry_author, weight=_entry_duration)
+        self.prefetch_depth = bot.config.prefetch_depth
+        self._prefetching = weakref.WeakSet()
+        self._prefetch_failed = weakref.WeakSet()
+        self.pending_entry = None  # Taken off the queue, but still waiting for its download
+
+        self.fair = bot.config.fair_queue
+        self._fair_keys = weakref.WeakKeyDictionary()  # entry -> (start, seq), the queue is kept in this order
+        self._fair_finish = {}  # author -> where their next song starts
+        self._fair_seq = 0
+        self._virtual_time = 0.0  # where the song at the front of the queue started
+
+        self._batch = None
 
     def __iter__(self):
         return iter(self.entries)
@@ -37,21 +88,151 @@ class Playlist(EventEmitter, Serializable):
         return len(self.entries)
 
     def shuffle(self):
-        shuffle(self.entries)
+        entries = list(self.entries)
+        shuffle(entries)
+        self._reorder(entries)
+
+    def reverse(self):
+        self._reorder(list(self.entries)[::-1])
+
+    def sort(self, key, reverse=False):
+        """
+            Sorts the queue by one of the `SORT_KEYS`.  Entries that compare equal keep their order.
+        """
+        self._reorder(sorted(self.entries, key=SORT_KEYS[key], reverse=reverse))
+
+    def dedupe(self):
+        """
+            Removes every entry for a song that's already queued ahead of it.  Returns the removed entries.
+        """
+        seen = set()
+        kept, removed = [], []
+
+        for entry in self.entries:
+            if entry.url in seen:
+                removed.append(entry)
+            else:
+                seen.add(entry.url)
+                kept.append(entry)
+
+        if removed:
+            self._reorder(kept, removed)
+
+        return removed
+
+    def _reorder(self, entries, removed=()):
+        # Puts the queue back together in one go, rather than moving entries one at a time
+        self.entries.replace(entries)
+        if self.fair:
+            self._rekey()
+
+        self._changed(removed=removed)
+
+    @contextmanager
+    def batch(self):
+        """
+            Groups queue changes together.  Listeners hear about all of them in one 'entries-changed' event when the
+            outermost batch ends, instead of an event per change.  Nothing is undone if the batch raises, whatever
+            changed up to that point is still announced.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        batch = self._batch = _Batch()
+        try:
+            yield batch
+
+        finally:
+            self._batch = None
+            self._announce(batch)
+
+    @contextmanager
+    def _collecting(self, batch):
+        """
+            Adds whatever changes in the block to `batch`, to be announced later with `_announce`.  Unlike `batch`
+            this can be picked up again after an await without holding back anyone else's changes in between.
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        self._batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch = None
+
+    def _announce(self, batch):
+        if batch.changed:
+            added, removed = set(batch.added), set(batch.removed)
+            self._changed(
+                added=[e for e in batch.added if e not in removed],
+                removed=[e for e in batch.removed if e not in added])
+
+    def _changed(self, added=(), removed=()):
+        if self._batch is not None:
+            self._batch.added.extend(added)
+            self._batch.removed.extend(removed)
+            self._batch.changed = True
+            return
+
+        self.emit('entries-changed', playlist=self, added=added, removed=removed)
+        self.prefetch()
+        self.downloader.reprioritize(self.loop)
+
+    def add_entries(self, entries):
+        """
+            Queues `entries` in one go, as one change.
+        """
+        entries = list(entries)
+
+        with self.batch():
+            if self.fair:
+                for entry in entries:
+                    self._fair_insert(entry)
+            else:
+                self.entries.extend(entries)
+
+            self._changed(added=entries)
+
+    def remove_if(self, predicate):
+        """
+            Removes every queued entry `predicate` is true for, in one pass.  Returns the removed entries.
+        """
+        kept, removed = [], []
+        for entry in self.entries:
+            (removed if predicate(entry) else kept).append(entry)
+
+        if removed:
+            self.entries.replace(kept)
+            self._changed(removed=removed)
+
+        return removed
+
+    def move_range(self, start, stop, to):
+        """
+            Moves the entries from index `start` up to `stop` so that they start at index `to`.
+        """
+        self.entries.move_range(start, stop, to)
+        if self.fair:
+            self._rekey()
+
+        self._changed()
 
     def clear(self):
+        removed = list(self.entries)
         self.entries.clear()
+        self._fair_finish.clear()
+        self._changed(removed=removed)
         
     def get_entry_at_index(self, index):
-        self.entries.rotate(-index)
-        entry = self.entries[0]
-        self.entries.rotate(index)
-        return entry
+        return self.entries[index]
         
     def delete_entry_at_index(self, index):
-        self.entries.rotate(-index)
-        entry = self.entries.popleft()
-        self.entries.rotate(index)
+        entry = self.entries[index]
+        del self.entries[index]
+        self._changed(removed=[entry])
         return entry
 
 
@@ -64,6 +245,14 @@ class Playlist(EventEmitter, Serializable):
             :param song_url: The song url to add to the playlist.
             :param meta: Any additional metadata to add to the playlist entry.
         """
+        entry = await self._resolve_entry(song_url, **meta)
+        position = self._add_entry(entry)
+        return entry, position
+
+    async def _resolve_entry(self, song_url, **meta):
+        """
+            Validates song_url and builds its entry, without adding it to the playlist.
+        """
 
         try:
             info = await self.downloader.extract_info(self.loop, song_url, download=False)
@@ -78,7 +267,7 @@ class Playlist(EventEmitter, Serializable):
             raise WrongEntryTypeError("This is a playlist.", True, info.get('webpage_url', None) or info.get('url', None))
 
         if info.get('is_live', False):
-            return await self.add_stream_entry(song_url, info=info, **meta)
+            return await self._resolve_stream_entry(song_url, info=info, **meta)
 
         # TODO: Extract this to its own function
         if info['extractor'] in ['generic', 'Dropbox']:
@@ -99,7 +288,7 @@ class Playlist(EventEmitter, Serializable):
 
                 elif content_type.startswith('text/html') and info['extractor'] == 'generic':
                     log.warning("Got text/html for content-type, this might be a stream.")
-                    return await self.add_stream_entry(song_url, info=info, **meta)  # TODO: Check for shoutcast/icecast
+                    return await self._resolve_stream_entry(song_url, info=info, **meta)  # TODO: Check for shoutcast/icecast
 
                 elif not content_type.startswith(('audio/', 'video/')):
                     log.warning("Questionable content-type \"{}\" for url {}".format(content_type, song_url))
@@ -112,10 +301,15 @@ class Playlist(EventEmitter, Serializable):
             self.downloader.ytdl.prepare_filename(info),
             **meta
         )
-        self._add_entry(entry)
-        return entry, len(self.entries)
+        entry.set_stream_info(info)
+        return entry
 
     async def add_stream_entry(self, song_url, info=None, **meta):
+        entry = await self._resolve_stream_entry(song_url, info=info, **meta)
+        position = self._add_entry(entry)
+        return entry, position
+
+    async def _resolve_stream_entry(self, song_url, info=None, **meta):
         if info is None:
             info = {'title': song_url, 'extractor': None}
 
@@ -161,8 +355,7 @@ class Playlist(EventEmitter, Serializable):
             destination = dest_url,
             **meta
         )
-        self._add_entry(entry)
-        return entry, len(self.entries)
+        return entry
 
     async def sub_entry(self, song_url, pos, **meta):
         """
@@ -221,6 +414,7 @@ class Playlist(EventEmitter, Serializable):
             self.downloader.ytdl.prepare_filename(info),
             **meta
         )
+        entry.set_stream_info(info)
         self._sub_entry(entry,pos)
         return entry, pos
 
@@ -251,37 +445,40 @@ class Playlist(EventEmitter, Serializable):
             url_field = 'webpage_url'
 
         baditems = 0
-        for item in info['entries']:
-            if item:
-                try:
-                    entry = URLPlaylistEntry(
-                        self,
-                        item[url_field],
-                        item.get('title', 'Untitled'),
-                        item.get('duration', 0) or 0,
-                        self.downloader.ytdl.prepare_filename(item),
-                        **meta
-                    )
-
-                    self._add_entry(entry)
-                    entry_list.append(entry)
-                except Exception as e:
+        with self.batch():
+            for item in info['entries']:
+                if item:
+                    try:
+                        entry = URLPlaylistEntry(
+                            self,
+                            item[url_field],
+                            item.get('title', 'Untitled'),
+                            item.get('duration', 0) or 0,
+                            self.downloader.ytdl.prepare_filename(item),
+                            **meta
+                        )
+                        entry.set_stream_info(item)
+
+                        self._add_entry(entry)
+                        entry_list.append(entry)
+                    except Exception as e:
+                        baditems += 1
+                        log.warning("Could not add item", exc_info=e)
+                        log.debug("Item: {}".format(item), exc_info=True)
+                else:
                     baditems += 1
-                    log.warning("Could not add item", exc_info=e)
-                    log.debug("Item: {}".format(item), exc_info=True)
-            else:
-                baditems += 1
 
         if baditems:
             log.info("Skipped {} bad entries".format(baditems))
 
         return entry_list, position
 
-    async def async_process_youtube_playlist(self, playlist_url, **meta):
+    async def async_process_youtube_playlist(self, playlist_url, *, max_duration=0, **meta):
         """
             Processes youtube playlists links from `playlist_url` in a questionable, async fashion.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param max_duration: Longest song allowed, for entries whose duration is only known once they're resolved
             :param meta: Any additional metadata to add to the playlist entry
         """
 
@@ -293,37 +490,17 @@ class Playlist(EventEmitter, Serializable):
         if not info:
             raise ExtractionError('Could not extract information from %s' % playlist_url)
 
-        gooditems = []
-        baditems = 0
+        baseurl = info['webpage_url'].split('playlist?list=')[0]
+        items = [(baseurl + 'watch?v=%s' % entry_data['id'], entry_data) if entry_data else None for entry_data in info['entries']]
 
-        for entry_data in info['entries']:
-            if entry_data:
-                baseurl = info['webpage_url'].split('playlist?list=')[0]
-                song_url = baseurl + 'watch?v=%s' % entry_data['id']
+        return await self._add_items_in_order(items, max_duration=max_duration, **meta)
 
-                try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
-
-                except ExtractionError:
-                    baditems += 1
-
-                except Exception as e:
-                    baditems += 1
-                    log.error("Error adding entry {}".format(entry_data['id']), exc_info=e)
-            else:
-                baditems += 1
-
-        if baditems:
-            log.info("Skipped {} bad entries".format(baditems))
-
-        return gooditems
-
-    async def async_process_sc_bc_playlist(self, playlist_url, **meta):
+    async def async_process_sc_bc_playlist(self, playlist_url, *, max_duration=0, **meta):
         """
             Processes soundcloud set and bancdamp album links from `playlist_url` in a questionable, async fashion.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param max_duration: Longest song allowed, for entries whose duration is only known once they're resolved
             :param meta: Any additional metadata to add to the playlist entry
         """
 
@@ -335,84 +512,311 @@ class Playlist(EventEmitter, Serializable):
         if not info:
             raise ExtractionError('Could not extract information from %s' % playlist_url)
 
-        gooditems = []
-        baditems = 0
+        items = [(entry_data['url'], entry_data) if entry_data else None for entry_data in info['entries']]
 
-        for entry_data in info['entries']:
-            if entry_data:
-                song_url = entry_data['url']
+        return await self._add_items_in_order(items, max_duration=max_duration, **meta)
 
-                try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
+    async def _add_items_in_order(self, items, *, max_duration=0, **meta):
+        """
+            Adds the `(song_url, entry_data)` pairs of a flat playlist listing in the given order.
 
-                except ExtractionError:
-                    baditems += 1
+            Items that come with a title are added as lazy entries straight away, if enabled.  The rest are
+            resolved as many at a time as there are metadata workers.  Each entry is added as soon as it and
+            everything before it is ready.  Listeners hear about the whole import in one 'entries-changed' event at
+            the end, rather than one per run of ready entries.
 
-                except Exception as e:
-                    baditems += 1
-                    log.error("Error adding entry {}".format(entry_data['id']), exc_info=e)
-            else:
-                baditems += 1
+            Returns the list of entries that were added.  Items that are None or fail to resolve are skipped.
+        """
+        semaphore = asyncio.Semaphore(self.downloader.metadata_pool.max_workers)
+        lazy = self.bot.config.lazy_playlist_entries
+
+        async def resolve(song_url, entry_data):
+            if lazy and entry_data.get('title'):
+                return LazyURLPlaylistEntry(
+                    self,
+                    song_url,
+                    entry_data['title'],
+                    entry_data.get('duration', 0) or 0,
+                    max_duration=max_duration,
+                    **meta
+                )
+
+            async with semaphore:
+                return await self._resolve_entry(song_url, **meta)
+
+        tasks = [asyncio.ensure_future(resolve(*item)) if item else None for item in items]
+
+        gooditems = []
+        baditems = 0
+        batch = _Batch()
+
+        try:
+            ready = 0
+            while ready < len(items):
+                if tasks[ready] and not tasks[ready].done():
+                    await asyncio.wait([tasks[ready]])
+
+                with self._collecting(batch):
+                    while ready < len(items) and (tasks[ready] is None or tasks[ready].done()):
+                        entry = self._resolved_entry(items[ready], tasks[ready])
+                        ready += 1
+
+                        if entry is None:
+                            baditems += 1
+                        else:
+                            self._add_entry(entry)
+                            gooditems.append(entry)
+        finally:
+            # Only does anything if we were cancelled part way through
+            for task in tasks:
+                if task:
+                    task.cancel()
+
+            # Anything played or removed in the meantime already went out in an event of its own
+            batch.added = [e for e in batch.added if self.position_of(e) is not None]
+            self._announce(batch)
 
         if baditems:
             log.info("Skipped {} bad entries".format(baditems))
 
         return gooditems
 
+    @staticmethod
+    def _resolved_entry(item, task):
+        if task is None:
+            return None
+
+        try:
+            return task.result()
+
+        except ExtractionError:
+            pass
+
+        except Exception as e:
+            log.error("Error adding entry {}".format(item[0]), exc_info=e)
+
     def _add_entry(self, entry, *, head=False):
+        """
+            Queues `entry` at the end, or at the front with `head`.  In fair mode it goes in its author's next turn
+            instead of the end.  Returns its 1-based position.
+        """
         if head:
+            self._key_at_head(entry)
             self.entries.appendleft(entry)
+            position = 1
+        elif self.fair:
+            position = self._fair_insert(entry) + 1
         else:
             self.entries.append(entry)
+            position = len(self.entries)
 
-        self.emit('entry-added', playlist=self, entry=entry)
+        if self._batch is not None:
+            self._changed(added=[entry])
+        else:
+            self.emit('entry-added', playlist=self, entry=entry)
+            self.prefetch()
 
-        if self.peek() is entry:
-            entry.get_ready_future()
+        return position
+
+    def _fair_insert(self, entry):
+        """
+            Start-time fair queueing: each author's songs are spaced 1 / share apart on a virtual clock, and a song
+            starts no earlier than the song at the front of the queue, so an author who was idle joins the current
+            round rather than catching up on the rounds they missed.  Returns the position `entry` went in at.
+        """
+        author = _entry_author(entry)
+        head = self.peek()
+
+        if head is None:
+            self._fair_finish.clear()
+        elif head in self._fair_keys:
+            self._virtual_time = self._fair_keys[head][0]
+
+        start = max(self._virtual_time, self._fair_finish.get(author, 0))
+        self._fair_finish[author] = start + 1 / self._share(author)
+
+        key = self._fair_keys[entry] = (start, self._fair_seq)
+        self._fair_seq += 1
+
+        position = self.entries.bisect(key, self._fair_key)
+        self.entries.insert(position, entry)
+        return position
+
+    def _fair_key(self, entry):
+        # Anything queued outside of fair mode stays ahead of what's queued in it
+        return self._fair_keys.get(entry, (float('-inf'), 0))
+
+    def _key_at_head(self, entry):
+        # Jumps the queue, keyed just ahead of whatever is at the front
+        head = self.peek()
+        if self.fair and head in self._fair_keys:
+            start, seq = self._fair_keys[head]
+            self._fair_keys[entry] = (start, seq - 1)
+
+    def _rekey(self):
+        """
+            Gives every queued entry a fair key that keeps the queue in the order it's in now, for when it was put in
+            order by hand.  Songs added later are slotted in around it.
+        """
+        self._fair_keys.clear()
+        self._fair_finish.clear()
+        start = self._virtual_time
+
+        for entry in self.entries:
+            author = _entry_author(entry)
+            start = max(start, self._fair_finish.get(author, 0))
+            self._fair_finish[author] = start + 1 / self._share(author)
+
+            self._fair_keys[entry] = (start, self._fair_seq)
+            self._fair_seq += 1
+
+    def _share(self, author):
+        if getattr(author, 'id', None) is None:
+            return PermissionsDefaults.QueueShare
+
+        return self.bot.permissions.for_user(author).queue_share
 
     def _sub_entry(self, entry, pos):
-        del self.entries[pos - 1]
-        self.entries.insert(pos - 1, entry)
+        old_entry = self.entries[pos - 1]
+        self.entries[pos - 1] = entry
+
+        if old_entry in self._fair_keys:
+            self._fair_keys[entry] = self._fair_keys.pop(old_entry)
 
     def promote_position(self, position):
-        rotDist = -1 * (position - 1)
-        self.entries.rotate(rotDist)
-        entry = self.entries.popleft()
-        self.entries.rotate(-1 * rotDist)
-        self.entries.appendleft(entry)
+        entry = self.entries[position - 1]
+        self._key_at_head(entry)
+        self.entries.move(position - 1, 0)
         self.emit('entry-added', playlist=self, entry=entry)
-        entry.get_ready_future()
+        self.prefetch()
+        self.downloader.reprioritize(self.loop)
         return entry
 
     def promote_last(self):
         entry = self.entries.pop()
+        self._key_at_head(entry)
         self.entries.appendleft(entry)
         self.emit('entry-added', playlist=self, entry=entry)
-        entry.get_ready_future()
-        return entr
+        self.prefetch()
+        self.downloader.reprioritize(self.loop)
+        return entry
 
     def remove_entry(self, index):
-        del self.entries[index]
+        self.delete_entry_at_index(index)
+
+    def take(self, entry):
+        """
+            Takes `entry` off the queue to be played, from the front or wherever it's got to.  Returns False if it
+            isn't queued.
+        """
+        if self.peek() is entry:
+            self.entries.popleft()
+            return True
+
+        try:
+            self.entries.remove(entry)
+        except ValueError:
+            return False
+
+        return True
+
+    def prefetch(self):
+        """
+            Starts downloading the next `prefetch_depth` entries, as far as the downloader and the disk allow.
+            The next entry is always fetched, further ones are skipped while prefetching is throttled and
+            picked up again as earlier prefetches finish.
+        """
+        for position, entry in enumerate(islice(self.entries, max(1, self.prefetch_depth))):
+            if entry.is_downloaded or entry in self._prefetching or entry in self._prefetch_failed:
+                continue
+
+            if position and not self._can_prefetch():
+                self.downloader.prefetches_throttled += 1
+                log.debug("Prefetching throttled at position {} of {}".format(position, self.prefetch_depth))
+                break
+
+            future = entry.get_ready_future()
+            self._prefetching.add(entry)
+            self.downloader.track_prefetch(future)
+            future.add_done_callback(functools.partial(self._prefetch_done, entry))
+
+    def _can_prefetch(self):
+        return self.downloader.can_prefetch() and not self.bot.audio_cache.full
+
+    def _prefetch_done(self, entry, future):
+        self._prefetching.discard(entry)
+
+        if not future.cancelled() and future.exception():
+            # It'll get another try when it comes up to play
+            log.debug("Prefetch of {} failed: {}".format(entry.url, future.exception()))
+            self._prefetch_failed.add(entry)
+
+        self.prefetch()
 
     async def get_next_entry(self, predownload_next=True):
         """
             A coroutine which will return the next song or None if no songs left to play.
 
             Additionally, if predownload_next is set to True, it will attempt to download the next
-            song to be played - so that it's ready by the time we get to it.
+            `prefetch_depth` songs to be played - so that they're ready by the time we get to them.
         """
         if not self.entries:
             return None
 
         entry = self.entries.popleft()
+        entry._awaiting_playback = True
+        future = entry.get_ready_future()
 
         if predownload_next:
-            next_entry = self.peek()
-            if next_entry:
-                next_entry.get_ready_future()
+            self.prefetch()
+
+        # The queue just moved, so whatever is downloading for it may need to jump ahead
+        self.downloader.reprioritize(self.loop)
+
+        self.pending_entry = entry
+        try:
+            if self.bot.config.progressive_playback and isinstance(entry, URLPlaylistEntry) and not future.done():
+                if await self._start_progressive(entry, future):
+                    return entry
 
-        return await entry.get_ready_future()
+            return await future
+        finally:
+            self.pending_entry = None
+
+    async def _start_progressive(self, entry, future):
+        """
+            Gives the download of `entry` a moment to finish, and otherwise readies it to be streamed while the
+            download carries on in the background, so the file is cached for later plays.
+            Returns False when the entry can't be streamed and has to be waited for.
+        """
+        done, __ = await asyncio.wait([future], timeout=PROGRESSIVE_GRACE)
+        if done:
+            return False
+
+        try:
+            await entry.get_stream_url()
+        except Exception as e:
+            log.warning("Cannot stream {}, waiting for the download instead ({})".format(entry.url, e))
+            return False
+
+        def background_download_done(f):
+            if not f.cancelled() and f.exception():
+                log.warning("Background download of {} failed: {}".format(entry.url, f.exception()))
+
+        future.add_done_callback(background_download_done)
+
+        # Nothing is waiting on this download anymore, let queued entries go first
+        entry._awaiting_playback = False
+        self.downloader.reprioritize(self.loop)
+
+        log.debug("Streaming {} while it downloads".format(entry.url))
+        return True
+
+    def position_of(self, entry):
+        """
+            Returns the 0-based queue position of `entry`, or None if it isn't queued.
+        """
+        return self.entries.find(entry)
 
     def peek(self):
         """
@@ -425,21 +829,35 @@ class Playlist(EventEmitter, Serializable):
         """
             (very) Roughly estimates the time till the queue will 'position'
         """
-        estimated_time = sum(e.duration for e in islice(self.entries, position - 1))
+        estimated_time = self.entries.weight_before(position - 1) + self._time_left_playing(player)
+        return datetime.timedelta(seconds=estimated_time)
+
+    def estimate_times(self, player):
+        """
+            Yields each queued entry along with the estimated time until it plays, in one pass over the queue.
+        """
+        time_left = self._time_left_playing(player)
+
+        for entry, before in self.entries.accumulate():
+            yield entry, datetime.timedelta(seconds=before + time_left)
 
+    @staticmethod
+    def _time_left_playing(player):
         # When the player plays a song, it eats the first playlist item, so we just have to add the time back
+        # Streams have no duration, and a song can play a little past the whole seconds its duration is given in
         if not player.is_stopped and player.current_entry:
-            estimated_time += player.current_entry.duration - player.progress
+            return max(0, player.current_entry.duration - player.progress)
 
-        return datetime.timedelta(seconds=estimated_time)
+        return 0
 
     def count_for_user(self, user):
-        return sum(1 for e in self.entries if e.meta.get('author', None) == user)
+        return self.entries.counts[user]
 
 
     def __json__(self):
         return self._enclose_json({
-            'entries': list(self.entries)
+            'entries': list(self.entries),
+            'prefetch_depth': self.prefetch_depth
         })
 
     @classmethod
@@ -448,8 +866,11 @@ class Playlist(EventEmitter, Serializable):
         # log.debug("Deserializing playlist")
         pl = cls(bot)
 
-        for entry in raw_json['entries']:
-            pl.entries.append(entry)
+        pl.entries.extend(raw_json['entries'])
+        if pl.fair:
+            pl._rekey()
+
+        pl.prefetch_depth = raw_json.get('prefetch_depth', pl.prefetch_depth)
 
         # TODO: create a function to init downloading (since we don't do it here)?
         return pl
@@ -0,0 +1,76 @@
+import re
+import logging
+
+from .loudness import FileAnalyzer, _run_ffmpeg_filter
+
+log = logging.getLogger(__name__)
+
+SILENCE_NOISE = '-50dB'  # anything quieter than this counts as silence
+SILENCE_MIN_DURATION = 0.5  # seconds, shorter gaps are part of the song
+EDGE_TOLERANCE = 0.05  # how close to the start or end a silence has to be to count as leading or trailing
+
+
+def measure_silence(filename):
+    """
+        Finds where the audio in `filename` starts and ends, past any leading and trailing silence.
+    """
+    output = _run_ffmpeg_filter(filename, 'silencedetect=noise={}:d={}'.format(SILENCE_NOISE, SILENCE_MIN_DURATION))
+
+    duration = re.search(r"Duration: (\d+):(\d+):([\d\.]+)", output)
+    duration = int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)) if duration else 0.0
+
+    starts = [float(t) for t in re.findall(r"silence_start: ([\-\d\.]+)", output)]
+    ends = [float(t) for t in re.findall(r"silence_end: ([\-\d\.]+)", output)]
+
+    start, end = 0.0, duration
+
+    if starts and ends and starts[0] <= EDGE_TOLERANCE:
+        start = ends[0]
+
+    # Silence that runs to the end of the file either has no end logged, or ends where the file does
+    if starts and (len(ends) < len(starts) or (duration and ends[-1] >= duration - EDGE_TOLERANCE)):
+        end = starts[-1]
+
+    return {'start': start, 'end': end, 'duration': duration}
+
+
+class SilenceAnalyzer(FileAnalyzer):
+    """
+        Finds the leading and trailing silence of downloaded files, so the player can skip it.
+    """
+
+    kind = 'silence'
+    failure_message = "Couldn't find the silence in {}, it will play untrimmed: {}"
+
+    def __init__(self, store, *, runner, loop=None):
+        super().__init__(store, runner=runner, loop=loop)
+        self.trimmed = 0.0
+
+    @property
+    def measurement(self):
+        return measure_silence
+
+    def bounds_for(self, filename):
+        """
+            Returns the (start, end) of the audio in `filename` in seconds, or None if there's nothing to trim or it
+            hasn't been measured yet.  The end is None if only the start needs trimming.
+        """
+        result = self.result_for(filename)
+        if result is None:
+            return None
+
+        start, end, duration = result['start'], result['end'], result['duration']
+
+        if end <= start + 1:
+            return None  # silent, or close enough that trimming would leave nothing
+
+        trim_end = duration and end < duration - EDGE_TOLERANCE
+        if start <= EDGE_TOLERANCE and not trim_end:
+            return None
+
+        self.trimmed += start + (duration - end if trim_end else 0)
+        return start, end if trim_end else None
+
+    def __str__(self):
+        return '{} plays measured, {} not ready\n{} files analysed, {:.0f}s skipped'.format(
+            self.hits, self.misses, self.analysed, self.trimmed)